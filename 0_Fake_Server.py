@@ -1,17 +1,37 @@
 # Version 4 : 2 Feb 25
-
+# Headless (no window, no Tk needed), e.g. for load tests :
+#   python 0_Fake_Server.py --headless --mode async --delay 20 --counters-only
+# The log file is written by a background thread (Middleware_Log.LogWriter : queued, written
+# in blocks, rotated at Log_Max_MB, Log_Backups files kept). Log_Mode = counters logs only
+# the message counters every Stats_Interval seconds instead of every message.
+
+import argparse
+import asyncio
+import functools
+import os
+import signal
 import socket
 import threading
-import tkinter as tk
-from tkinter import Button
+from collections import deque
 from datetime import datetime
 import time
 import configparser
 import random
 import string
-import pyodbc  # MSSQL connection
+
+from Middleware_Log import LogWriter
+
+try:
+    import tkinter as tk
+    from tkinter import Button
+except ImportError:  # Headless only
+    tk = None
 
 BACKROUND_COLOR = (230, 242, 255) # Pale blue
+READ_LIMIT = 1024 * 1024  # Max length of one message line in async mode
+MONITOR_INTERVAL = 100  # ms between two refreshes of the monitor windows
+MONITOR_LINES = 500     # Lines kept per monitor window
+COUNTERS = ('connections', 'received', 'sent', 'errors')
 
 class FakeTCPServer:
     def __init__(self, master, config):
@@ -21,16 +41,33 @@ class FakeTCPServer:
         self.machine_names = config['Machine_Names']
         self.ports = config['Ports']
         self.response_delay = config['Response_Delay'] / 1000  # Convert ms to seconds
+        self.server_mode = config['Server_Mode']  # thread : threads per port / client, async : one event loop for all ports
+        self.loop = None
+        self.clients = {}  # Async mode : writer -> reply task of each open connection
         self.log_file = config['Log_File']
 
         self.db_connection_string = f"DRIVER={{SQL Server}};SERVER={config['MSSQL_Address']};DATABASE={config['MSSQL_DB']};UID={config['User']};PWD={config['Pwd']};"
         self.table_false = config['Table_False']
         self.server_threads = []
         self.response_counters = {port: 0 for port in self.ports}
+        self.running = False
+
+        self.counters_only = config['Log_Mode'] == 'counters'
+        self.counters = {port: dict.fromkeys(COUNTERS, 0) for port in self.ports}
+        self.counters_lock = threading.Lock()
+        self.last_report = (time.monotonic(), 0, 0)  # (time, received, sent) of the last report_counters()
+        log_dir, log_name = os.path.split(os.path.abspath(self.log_file))
+        self.log_writer = LogWriter(log_dir, log_name, config['Log_Max_MB'] * 1024 * 1024, 'size', config['Log_Backups'])
+
+        self.monitor_queue = deque()  # (port, line) for the monitor windows, shown by the Tk thread
+        if self.master is not None:
+            self.setup_window()
+
+    def setup_window(self):
         # Tkinter setup
+        master = self.master
         self.master.geometry("1200x700")  # Make the window wider
         self.master.title("Fake TCP Server")
-        self.running = False
         self.frames = {}
         self.text_widgets = {}
 
@@ -43,6 +80,7 @@ class FakeTCPServer:
         self.setup_monitor_windows()
 
         self.master.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.master.after(MONITOR_INTERVAL, self.refresh_monitor)
 
     def setup_monitor_windows(self):
         max_rows = 4
@@ -68,13 +106,43 @@ class FakeTCPServer:
         for i in range(cols):
             self.master.columnconfigure(i, weight=1)
 
-    def log_message(self, port, message):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] {message}\n"
-        self.text_widgets[port].insert(tk.END, log_entry)
-        self.text_widgets[port].see(tk.END)
-        with open(self.log_file, "a") as log:
-            log.write(log_entry)
+    def log_message(self, port, message, counter=None):
+        # Called from the socket threads / event loop : only counts and queues, never touches Tk or the disk
+        if counter is not None:
+            with self.counters_lock:
+                self.counters[port][counter] += 1
+        if self.counters_only:
+            return
+        self.log_writer.write(f"Port {port} : {message.rstrip()}")
+        if self.master is not None:
+            self.monitor_queue.append((port, f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}\n"))
+
+    def refresh_monitor(self):
+        # Tk thread : one insert per window for everything logged since the last refresh
+        lines = {}
+        for _ in range(len(self.monitor_queue)):
+            port, line = self.monitor_queue.popleft()
+            lines.setdefault(port, []).append(line)
+        for port, port_lines in lines.items():
+            text_widget = self.text_widgets[port]
+            text_widget.insert(tk.END, ''.join(port_lines[-MONITOR_LINES:]))
+            text_widget.delete("1.0", f"end-{MONITOR_LINES + 1} lines")
+            text_widget.see(tk.END)
+        self.master.after(MONITOR_INTERVAL, self.refresh_monitor)
+
+    def report_counters(self):
+        # One line with the totals and the rates since the last report, also written to the log
+        with self.counters_lock:
+            totals = {name: sum(counters[name] for counters in self.counters.values()) for name in COUNTERS}
+        now = time.monotonic()
+        last_time, last_received, last_sent = self.last_report
+        elapsed = max(1e-3, now - last_time)
+        self.last_report = (now, totals['received'], totals['sent'])
+        report = (f"Received {totals['received']} ({(totals['received'] - last_received) / elapsed:.0f}/s), "
+                  f"sent {totals['sent']} ({(totals['sent'] - last_sent) / elapsed:.0f}/s), "
+                  f"{totals['connections']} connections, {totals['errors']} errors")
+        self.log_writer.write(report)
+        return report
 
     def clear_logs(self):
         for text_widget in self.text_widgets.values():
@@ -97,31 +165,39 @@ class FakeTCPServer:
             self.update_background(BACKROUND_COLOR)  # Change background to pale blue when running
 
     def handle_client(self, client_socket, port):
+        buffer = ""
         while self.running:
             try:
-                data = client_socket.recv(1024).decode('utf-8')
-                if not data:
+                chunk = client_socket.recv(1024).decode('utf-8')
+                if not chunk:
                     break
-                self.log_message(port, f"Received: {data}")
-                
-				# Parse message type
-                if data.startswith("\x02uploadData;"):
-                    response = self.handle_upload_data(port)
-                elif data.startswith("\x02productStart;"):
-                    response = self.handle_product_start(port, data)
-                elif data.startswith("\x02uploadFailures;"):
-                    response = self.handle_upload_failure(port)
-                else:
-                    response = "Unknown message type"
 
-                time.sleep(self.response_delay)
-                client_socket.sendall(response.encode('utf-8'))
-                self.log_message(port, f"Sent: {response}")
+                # A pipelining client sends several messages back to back : answer each line separately
+                buffer += chunk
+                *messages, buffer = buffer.split("\n")
+
+                for data in messages:
+                    data += "\n"
+                    self.log_message(port, f"Received: {data}", 'received')
+                    response = self.build_response(port, data)
+                    time.sleep(self.response_delay)
+                    client_socket.sendall(response.encode('utf-8'))
+                    self.log_message(port, f"Sent: {response}", 'sent')
             except Exception as e:
-                self.log_message(port, f"Error: {e}")
+                self.log_message(port, f"Error: {e}", 'errors')
                 break
         client_socket.close()
 
+    def build_response(self, port, data):
+        # Parse message type
+        if data.startswith("\x02uploadData;"):
+            return self.handle_upload_data(port)
+        elif data.startswith("\x02productStart;"):
+            return self.handle_product_start(port, data)
+        elif data.startswith("\x02uploadFailures;"):
+            return self.handle_upload_failure(port)
+        return "Unknown message type\n"
+
 	# Sub-routine to handle each message type
         
     def generate_random_serial(self):
@@ -138,6 +214,7 @@ class FakeTCPServer:
         block_numbers = []
         
         try:
+            import pyodbc  # MSSQL connection, only needed for productStart
             with pyodbc.connect(self.db_connection_string) as conn: #Used with statements to auto-close DB connections.
                 with conn.cursor() as cursor:
                     cursor.execute(query, (boardrecord,))
@@ -179,7 +256,7 @@ class FakeTCPServer:
         while self.running:
             try:
                 client_socket, addr = server_socket.accept()
-                self.log_message(port, f"Connection from {addr}")
+                self.log_message(port, f"Connection from {addr}", 'connections')
                 client_thread = threading.Thread(target=self.handle_client, args=(client_socket, port))
                 client_thread.daemon = True
                 client_thread.start()
@@ -190,10 +267,98 @@ class FakeTCPServer:
                 break
         server_socket.close()
 
+    ### Async mode : all ports and clients in one event loop thread ###
+    # Hundreds of ports / connections without a thread each. The response delay is not a
+    # sleep : each reply is due response_delay after its message and a writer task per
+    # connection sends the replies in order when they are due, so pipelined messages are
+    # delayed in parallel and the loop keeps serving the other clients meanwhile.
+
+    async def send_replies(self, port, writer, replies):
+        while True:
+            item = await replies.get()
+            if item is None:
+                return
+            due, response = item
+            wait = due - self.loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                writer.write(response.encode('utf-8'))
+                if replies.empty():
+                    await writer.drain()  # Slow reader : wait here, not in the other connections
+            except (ConnectionError, OSError) as e:
+                self.log_message(port, f"Error: {e}", 'errors')
+                return
+            self.log_message(port, f"Sent: {response}", 'sent')
+
+    async def serve_client(self, reader, writer, port):
+        self.log_message(port, f"Connection from {writer.get_extra_info('peername')}", 'connections')
+        replies = asyncio.Queue()
+        sender = self.loop.create_task(self.send_replies(port, writer, replies))
+        self.clients[writer] = sender
+        try:
+            while self.running and not sender.done():
+                line = await reader.readline()
+                if not line.endswith(b"\n"):
+                    break  # Closed (a last unterminated line is dropped, like in thread mode)
+                data = line.decode('utf-8')
+                self.log_message(port, f"Received: {data}", 'received')
+                if data.startswith("\x02productStart;"):
+                    response = await self.loop.run_in_executor(None, self.build_response, port, data)  # Blocking DB query
+                else:
+                    response = self.build_response(port, data)
+                replies.put_nowait((self.loop.time() + self.response_delay, response))
+        except (ConnectionError, OSError, UnicodeDecodeError, ValueError) as e:  # ValueError : line over READ_LIMIT
+            self.log_message(port, f"Error: {e}", 'errors')
+        finally:
+            replies.put_nowait(None)
+            await asyncio.gather(sender, return_exceptions=True)  # Cancelled by stop_servers()
+            del self.clients[writer]
+            writer.close()
+
+    def run_event_loop(self):
+        asyncio.set_event_loop(self.loop)
+        servers = []
+        for port in self.ports:
+            try:
+                server = self.loop.run_until_complete(asyncio.start_server(
+                    functools.partial(self.serve_client, port=port), "0.0.0.0", port, limit=READ_LIMIT))
+                servers.append(server)
+                self.log_message(port, f"Listening on port {port}")
+            except OSError as e:
+                self.log_message(port, f"Server error: {e}")
+
+        self.loop.run_forever()  # Until stop_servers()
+
+        # No new clients, the connections are closed (serve_client() sees the end of its reader and
+        # returns) and the replies not sent are dropped, then what is left is cancelled. Only then
+        # the servers are waited for, recent Pythons also wait for their connections there
+        for server in servers:
+            server.close()
+        for writer, sender in list(self.clients.items()):
+            sender.cancel()
+            writer.close()
+        tasks = asyncio.all_tasks(self.loop)
+        if tasks:
+            _, pending = self.loop.run_until_complete(asyncio.wait(tasks, timeout=1))
+            for task in pending:
+                task.cancel()  # e.g. waiting for the DB query of a productStart
+            self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        for server in servers:
+            self.loop.run_until_complete(server.wait_closed())
+        self.loop.close()
+
     def start_servers(self):
         if self.running:
             return
         self.running = True
+        if self.server_mode == 'async':
+            self.loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=self.run_event_loop, name="fake_server_loop")
+            thread.daemon = True
+            self.server_threads.append(thread)
+            thread.start()
+            return
         for port in self.ports:
             thread = threading.Thread(target=self.start_server, args=(port,))
             thread.daemon = True
@@ -202,14 +367,18 @@ class FakeTCPServer:
 
     def stop_servers(self):
         self.running = False
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
         for thread in self.server_threads:
             thread.join(timeout=1)
         for port in self.ports: 
             self.log_message(port, f"Connection closed.")
         self.server_threads = []
+        self.loop = None
 
     def on_close(self):
         self.stop_servers()
+        self.log_writer.close()
         self.master.destroy()
 
 def read_config(file_path):
@@ -225,12 +394,59 @@ def read_config(file_path):
         'Machine_Names': [ft.strip() for ft in parser.get('HSC_Server', 'Machine_Names').split(',')],
         'Ports': list(map(int, parser.get('HSC_Server', 'Ports').split(','))),
         'Response_Delay': parser.getint('HSC_Server', 'Response_Delay'),
-        'Log_File': parser.get('HSC_Server', 'Log_File')
+        'Server_Mode': parser.get('HSC_Server', 'Server_Mode', fallback='thread').strip().lower(),
+        'Log_File': parser.get('HSC_Server', 'Log_File'),
+        'Log_Mode': parser.get('HSC_Server', 'Log_Mode', fallback='full').strip().lower(),
+        'Log_Max_MB': parser.getint('HSC_Server', 'Log_Max_MB', fallback=10),
+        'Log_Backups': parser.getint('HSC_Server', 'Log_Backups', fallback=5),
+        'Stats_Interval': parser.getfloat('HSC_Server', 'Stats_Interval', fallback=10),
     }
 
-def main():
+def run_headless(config):
+    server = FakeTCPServer(None, config)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    server.start_servers()
+    print(f"Fake TCP Server started headless ({config['Server_Mode']} mode) on {len(config['Ports'])} port(s), "
+          f"response delay {config['Response_Delay']} ms, log mode {config['Log_Mode']}", flush=True)
+    while not stop_event.wait(config['Stats_Interval']):
+        print(server.report_counters(), flush=True)
+    server.stop_servers()
+    print(server.report_counters(), flush=True)
+    server.log_writer.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake HSC server")
+    parser.add_argument('--headless', action='store_true', help="No window, counters printed every Stats_Interval seconds")
+    parser.add_argument('--config', default="0_Fake_Server_setting.ini")
+    parser.add_argument('--mode', choices=['thread', 'async'], help="Override [HSC_Server] Server_Mode")
+    parser.add_argument('--ports', help="Override [HSC_Server] Ports, e.g. 5335,5336 or 6000-6299")
+    parser.add_argument('--delay', type=int, help="Override [HSC_Server] Response_Delay (ms)")
+    parser.add_argument('--counters-only', action='store_true', help="Log_Mode = counters : no line per message")
+    args = parser.parse_args(argv)
+
+    config = read_config(args.config)
+    if args.mode:
+        config['Server_Mode'] = args.mode
+    if args.ports:
+        ports = []
+        for part in args.ports.split(','):
+            first, _, last = part.partition('-')
+            ports.extend(range(int(first), int(last or first) + 1))
+        config['Ports'] = ports
+        config['Machine_Names'] = [f"Port {port}" for port in ports]
+    if args.delay is not None:
+        config['Response_Delay'] = args.delay
+    if args.counters_only:
+        config['Log_Mode'] = 'counters'
+
+    if args.headless:
+        run_headless(config)
+        return
     root = tk.Tk()
-    config = read_config("0_Fake_Server_setting.ini")
     app = FakeTCPServer(root, config)
     root.mainloop()
 
@@ -1,5 +1,7 @@
-import tkinter as tk
-from tkinter import ttk, messagebox
+import argparse
+import json
+import multiprocessing
+import sys
 import os
 import random
 import time
@@ -23,17 +25,18 @@ def read_settings():
 
     return source_dir, source_sub_dirs, result_percentages
 
-def generate_result_code(result_percentages):
+def generate_result_code(result_percentages, rng=random):
     total = sum(result_percentages.values())
-    pick = random.randint(1, total)
+    pick = rng.randint(1, total)
     current = 0
     for result, weight in result_percentages.items():
         current += weight
         if pick <= current:
             return result
 
-def generate_filename(result_code):
-    random_number = str(random.randint(100000000, 999999999))
+def generate_filename(result_code, random_number=None):
+    if random_number is None:
+        random_number = str(random.randint(100000000, 999999999))
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
     return f"333240D001250{random_number}_{timestamp}_{result_code}.csv"
 
@@ -93,42 +96,211 @@ def stop_writing():
     stop_thread = True
     send_button.config(state=tk.NORMAL)  # Re-enable the Send button
 
-# Create the GUI app
-app = tk.Tk()
-app.title("File Writer App")
-app.resizable(False, False)  # Make the window unresizable
-
-# Input for 'File number per line'
-file_number_label = ttk.Label(app, text="PCB measured per line:")
-file_number_label.grid(row=0, column=0, padx=10, pady=10)
-file_number_var = tk.StringVar()
-file_number_var.set("5")  # ✅ Default value here
-file_number_entry = ttk.Entry(app, textvariable=file_number_var)
-file_number_entry.grid(row=0, column=1, padx=10, pady=10)
-
-# Input for 'Interval'
-interval_label = ttk.Label(app, text="Unit-to-Unit Interval (ms):")
-interval_label.grid(row=1, column=0, padx=10, pady=10)
-interval_var = tk.StringVar()
-interval_var.set("500")  # ✅ Default value here
-interval_entry = ttk.Entry(app, textvariable=interval_var)
-interval_entry.grid(row=1, column=1, padx=10, pady=10)
-
-# Progress bar
-progress_var = tk.IntVar()
-progress_bar = ttk.Progressbar(app, variable=progress_var, maximum=100)
-progress_bar.grid(row=2, column=0, columnspan=2, padx=10, pady=10, sticky="ew")
-
-# Progress label
-progress_label = ttk.Label(app, text="Progress: 0%")
-progress_label.grid(row=3, column=0, columnspan=2, pady=10)
-
-# Send button
-send_button = ttk.Button(app, text="Send", command=start_writing)
-send_button.grid(row=4, column=0, pady=20)
-
-# Cancel button
-cancel_button = ttk.Button(app, text="Cancel", command=stop_writing)
-cancel_button.grid(row=4, column=1, pady=20)
-
-app.mainloop()
+########### Headless generator ##########
+# Stress mode without the window, e.g. 5000 files/s over 60 lines or a backlog of 1M files :
+#   python 2_CSVFile_Writer.py --headless --rate 5000 --lines 60 --duration 60 --profile poisson
+#   python 2_CSVFile_Writer.py --headless --backlog 1000000 --duration 0
+# The lines are shared out between --workers processes, each with its own seeded random
+# generator (same --seed = same files), so the rate is not capped by one thread.
+# Profiles : constant (fixed interval), poisson (random arrivals at the mean rate),
+# bursty (Poisson bursts of --burst boards on average, like a line emptying its buffer).
+# File type per line from [General] File_Types (CSV or XML, Palmi report), or --format.
+# XML size from [XML_Report] (Components, Pads per component, Date_Folders) or --components /
+# --pads / --date-folders, e.g. --components 5000 --pads 8 for a worst-case report of ~4 MB.
+# Prints a JSON summary (files written, achieved rate, max lateness).
+
+_made_dirs = set()  # Date folders already created by write_xml()
+
+def write_csv(line_dir, serial, result_code):
+    with open(os.path.join(line_dir, generate_filename(result_code, serial)), "w") as f:
+        f.write(f"Result: {result_code}\n")
+
+def write_xml(line_dir, serial, event_id, result_code, components=0, pads=0, date_folders=False, rng=random):
+    # Palmi report with the fields of [PALMI_XML_Mapping] in 1_SPI_Middleware_setting.ini
+    # (Panel@index, Panel@barcode, Panel@start_Insptime, Board@inspresult), then components
+    # Component elements of pads Pad elements each, the bulk of a real report.
+    # date_folders : written into <line_dir>/YYYY/MM/DD like the AOI, for the recursive scan
+    now = datetime.now()
+    timestamp = now.strftime("%Y%m%d%H%M%S")
+    if date_folders:
+        line_dir = os.path.join(line_dir, now.strftime("%Y"), now.strftime("%m"), now.strftime("%d"))
+        if line_dir not in _made_dirs:
+            os.makedirs(line_dir, exist_ok=True)
+            _made_dirs.add(line_dir)
+    failed = result_code not in ("OK", "WN", "Judge")
+    inspresult = 1 if failed else 0
+    barcode = f"333240D001250{serial}"
+    parts = [f'<?xml version="1.0" encoding="utf-8"?>\n<Report>\n'
+             f'  <Panel index="{event_id}" barcode="{barcode}" start_Insptime="{timestamp}">\n'
+             f'    <Board index="1" barcode="{barcode}" inspresult="{inspresult}">\n']
+    bad_component = rng.randrange(components) if failed and components else -1  # One NG component on a NG board
+    for c in range(components):
+        parts.append(f'      <Component name="C{c + 1}" partnumber="P{c % 50:04d}" result="{1 if c == bad_component else 0}">\n')
+        for p in range(pads):
+            volume = rng.uniform(40.0, 160.0) if c == bad_component and p == 0 else rng.uniform(85.0, 115.0)
+            parts.append(f'        <Pad id="{p + 1}" volume="{volume:.1f}" area="{rng.uniform(90.0, 110.0):.1f}" '
+                         f'height="{rng.uniform(100.0, 150.0):.1f}" offsetX="{rng.uniform(-20.0, 20.0):.1f}" '
+                         f'offsetY="{rng.uniform(-20.0, 20.0):.1f}" result="{1 if c == bad_component and p == 0 else 0}"/>\n')
+        parts.append('      </Component>\n')
+    parts.append('    </Board>\n  </Panel>\n</Report>\n')
+    with open(os.path.join(line_dir, f"{serial}_{timestamp}.xml"), "w") as f:
+        f.write(''.join(parts))
+
+def arrival_gaps(profile, rate, rng, burst=10):
+    # Endless seconds between two files, mean rate files per second
+    while True:
+        if profile == "constant":
+            yield 1 / rate
+        elif profile == "poisson":
+            yield rng.expovariate(rate)
+        else:  # bursty : a burst arrives every burst / rate seconds on average, its files back to back
+            size = max(1, int(rng.expovariate(1 / burst)))
+            yield rng.expovariate(rate / burst)
+            for _ in range(size - 1):
+                yield 0.0
+
+def generate_worker(worker_id, lines, rate, duration, backlog, profile, burst, seed, result_percentages, start_at, xml_size=(0, 0, False)):
+    # One process : lines = [(folder, 'CSV' or 'XML')], xml_size = (components, pads, date folders),
+    # returns (backlog written, files written, max lateness s)
+    rng = random.Random(seed * 1000 + worker_id)
+    counter = 0
+
+    def write_one(line_dir, file_type):
+        nonlocal counter
+        serial = f"{worker_id:02d}{counter % 10000000:07d}"  # Unique per worker, 9 digits like the GUI
+        result_code = generate_result_code(result_percentages, rng)
+        if file_type == "XML":
+            write_xml(line_dir, serial, counter % 9999 + 1, result_code, *xml_size, rng=rng)
+        else:
+            write_csv(line_dir, serial, result_code)
+        counter += 1
+
+    for i in range(backlog):
+        write_one(*lines[i % len(lines)])
+    seeded = counter
+
+    time.sleep(max(0.0, start_at - time.time()))  # All processes start the paced part together
+    start = time.monotonic()
+    due = start
+    late = 0.0
+    if rate > 0:
+        for gap in arrival_gaps(profile, rate, rng, burst):
+            due += gap
+            if due - start >= duration:
+                break
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                late = max(late, -wait)  # Behind schedule : written right away, no drift
+            write_one(*rng.choice(lines))
+    return seeded, counter - seeded, late
+
+def run_headless(argv):
+    from concurrent.futures import ProcessPoolExecutor
+
+    parser = argparse.ArgumentParser(description="Headless result file generator")
+    parser.add_argument("--rate", type=float, default=100.0, help="Files per second, all lines together")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of generation")
+    parser.add_argument("--lines", type=int, help="Number of lines (folders L01..), default : [General] Source_sub_dir")
+    parser.add_argument("--backlog", type=int, default=0, help="Files written at once before the paced part, in total for all lines (spread evenly over them)")
+    parser.add_argument("--profile", choices=["constant", "poisson", "bursty"], default="poisson")
+    parser.add_argument("--burst", type=float, default=10.0, help="Mean burst size of the bursty profile")
+    parser.add_argument("--format", choices=["config", "csv", "xml"], default="config", help="config : [General] File_Types")
+    parser.add_argument("--components", type=int, help="Component elements per XML board, default : [XML_Report] Components")
+    parser.add_argument("--pads", type=int, help="Pad elements per component, default : [XML_Report] Pads")
+    parser.add_argument("--date-folders", type=int, choices=[0, 1], help="XML in YYYY/MM/DD sub-folders, default : [XML_Report] Date_Folders")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--source-dir", help="Override [General] Source_dir")
+    args = parser.parse_args(argv)
+
+    source_dir, source_sub_dirs, result_percentages = read_settings()
+    source_dir = args.source_dir or source_dir
+    config = ConfigParser()
+    config.read("2_CSVFile_Writer_setting.ini")
+    file_types = [t.strip().upper() for t in config.get("General", "File_Types", fallback="").split(",") if t.strip()]
+    xml_size = (args.components if args.components is not None else config.getint("XML_Report", "Components", fallback=0),
+                args.pads if args.pads is not None else config.getint("XML_Report", "Pads", fallback=0),
+                bool(args.date_folders if args.date_folders is not None else config.getint("XML_Report", "Date_Folders", fallback=0)))
+    if args.lines:
+        source_sub_dirs = [f"L{i + 1:02d}" for i in range(args.lines)]
+    if args.format != "config":
+        file_types = [args.format.upper()] * len(source_sub_dirs)
+    file_types = (file_types + ["CSV"] * len(source_sub_dirs))[:len(source_sub_dirs)]
+
+    lines = []
+    for sub_dir, file_type in zip(source_sub_dirs, file_types):
+        os.makedirs(os.path.join(source_dir, sub_dir), exist_ok=True)
+        lines.append((os.path.join(source_dir, sub_dir), file_type))
+
+    # Lines are dealt out to the processes, each gets the rate / backlog share of its lines.
+    # Line j gets backlog // len(lines) files, one more for the first backlog % len(lines) lines
+    workers = max(1, min(args.workers, len(lines)))
+    shares = [lines[i::workers] for i in range(workers)]
+    line_backlog = [args.backlog // len(lines) + (1 if j < args.backlog % len(lines) else 0) for j in range(len(lines))]
+    start_at = time.time() + 0.5 + 0.1 * workers  # Time for the processes to start
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(generate_worker, worker_id, share, args.rate * len(share) / len(lines), args.duration,
+                               sum(line_backlog[worker_id::workers]),
+                               args.profile, args.burst, args.seed, result_percentages, start_at, xml_size)
+                   for worker_id, share in enumerate(shares)]
+        results = [future.result() for future in futures]
+
+    seeded = sum(result[0] for result in results)
+    written = sum(result[1] for result in results)
+    print(json.dumps({"lines": len(lines), "workers": workers, "profile": args.profile, "seed": args.seed,
+                      "backlog": seeded, "files": written, "duration": args.duration,
+                      "rate_target": args.rate, "rate_achieved": round(written / args.duration, 1) if args.duration else None,
+                      "max_late_ms": round(max(result[2] for result in results) * 1000, 1),
+                      "elapsed_s": round(time.monotonic() - started, 2)}))
+    return 0
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Generator processes of a packaged exe stop here
+    if "--headless" in sys.argv:
+        sys.exit(run_headless([arg for arg in sys.argv[1:] if arg != "--headless"]))
+
+    import tkinter as tk  # Only for the window : the headless generator (and its processes) run without Tk
+    from tkinter import ttk, messagebox
+
+    # Create the GUI app
+    app = tk.Tk()
+    app.title("File Writer App")
+    app.resizable(False, False)  # Make the window unresizable
+
+    # Input for 'File number per line'
+    file_number_label = ttk.Label(app, text="PCB measured per line:")
+    file_number_label.grid(row=0, column=0, padx=10, pady=10)
+    file_number_var = tk.StringVar()
+    file_number_var.set("5")  # ✅ Default value here
+    file_number_entry = ttk.Entry(app, textvariable=file_number_var)
+    file_number_entry.grid(row=0, column=1, padx=10, pady=10)
+
+    # Input for 'Interval'
+    interval_label = ttk.Label(app, text="Unit-to-Unit Interval (ms):")
+    interval_label.grid(row=1, column=0, padx=10, pady=10)
+    interval_var = tk.StringVar()
+    interval_var.set("500")  # ✅ Default value here
+    interval_entry = ttk.Entry(app, textvariable=interval_var)
+    interval_entry.grid(row=1, column=1, padx=10, pady=10)
+
+    # Progress bar
+    progress_var = tk.IntVar()
+    progress_bar = ttk.Progressbar(app, variable=progress_var, maximum=100)
+    progress_bar.grid(row=2, column=0, columnspan=2, padx=10, pady=10, sticky="ew")
+
+    # Progress label
+    progress_label = ttk.Label(app, text="Progress: 0%")
+    progress_label.grid(row=3, column=0, columnspan=2, pady=10)
+
+    # Send button
+    send_button = ttk.Button(app, text="Send", command=start_writing)
+    send_button.grid(row=4, column=0, pady=20)
+
+    # Cancel button
+    cancel_button = ttk.Button(app, text="Cancel", command=stop_writing)
+    cancel_button.grid(row=4, column=1, pady=20)
+
+    app.mainloop()
@@ -0,0 +1,260 @@
+# Load test of the whole chain on loopback, no Tk window and nobody clicking "Send" :
+#   file generator (thread, 2_CSVFile_Writer.py functions)  ->  middleware (Middleware_Service.py subprocess)
+#   ->  HSC (0_Fake_Server.py --headless --mode async subprocess)
+# For every combination of the swept parameters a fresh temp tree is used, a backlog is
+# seeded before the middleware starts, then files are written at the given rate. The
+# end-to-end latency of each board (file written -> ACK) comes from the structured upload
+# log of the middleware (Middleware_Events.py), CPU / memory from its process.
+#
+#   python 3_Load_Test.py --lines 1,8 --rate 50,200 --delay 0,20 --backlog 0,1000 --duration 10 --profile poisson --out result.json
+#
+# Result : one JSON object per scenario (throughput, latency p50/p99/max, CPU, RSS, ...).
+# psutil is used for CPU / RSS when it is installed, /proc otherwise (Linux); both None elsewhere.
+import argparse
+import configparser
+import glob
+import importlib
+import itertools
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+BASE_CONFIG = '1_SPI_Middleware_setting.ini'
+FAKE_SERVER_CONFIG = '0_Fake_Server_setting.ini'
+
+########### HSC ##########
+
+def start_fake_server(base_dir, ports, delay_ms):
+    # 0_Fake_Server.py headless in async mode (one event loop for all ports), only its counters logged
+    config = configparser.ConfigParser()
+    config.read(FAKE_SERVER_CONFIG)
+    config['HSC_Server']['Log_File'] = os.path.join(base_dir, 'fake_server_log.txt')
+    config_path = os.path.join(base_dir, 'fake_server.ini')
+    with open(config_path, 'w') as f:
+        config.write(f)
+    server = subprocess.Popen([sys.executable, '0_Fake_Server.py', '--headless', '--mode', 'async', '--config', config_path,
+                               '--ports', ','.join(map(str, ports)), '--delay', str(delay_ms), '--counters-only'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    for port in ports:  # Listening before the backlog is timed
+        while server.poll() is None and time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+    if server.poll() is not None:
+        raise RuntimeError(f"0_Fake_Server.py exited with code {server.returncode}")
+    return server
+
+def stop_process(process, timeout=10):
+    # Clean stop (SIGINT; terminate on Windows), killed if it does not end in time
+    process.send_signal(signal.SIGINT if os.name != 'nt' else signal.SIGTERM)
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+########### File generator ##########
+
+class FileWriter:
+    # CSV result files from the headless generator of 2_CSVFile_Writer.py, round robin over the line folders
+    def __init__(self, line_dirs, seed=1):
+        self.generator = importlib.import_module('2_CSVFile_Writer')  # No window on import
+        _, _, self.result_percentages = self.generator.read_settings()
+        self.line_dirs = line_dirs
+        self.random = random.Random(seed)
+        self.written = 0
+
+    def write_one(self):
+        line_dir = self.line_dirs[self.written % len(self.line_dirs)]
+        result_code = self.generator.generate_result_code(self.result_percentages, self.random)
+        self.generator.write_csv(line_dir, f"{self.written:09d}", result_code)
+        self.written += 1
+
+    def run(self, rate, duration, profile, stop_event):
+        # rate files per second on average for duration seconds, without drift : a late file is written right away
+        start = time.monotonic()
+        due = start
+        for gap in self.generator.arrival_gaps(profile, rate, self.random):
+            due += gap
+            if due - start >= duration:
+                return
+            wait = due - time.monotonic()
+            if wait > 0 and stop_event.wait(wait):
+                return
+            self.write_one()
+
+########### Middleware process ##########
+
+def free_ports(count):
+    # Ports the OS considers free right now
+    sockets, ports = [], []
+    for _ in range(count):
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        sockets.append(s)
+        ports.append(s.getsockname()[1])
+    for s in sockets:
+        s.close()
+    return ports
+
+def write_config(base_dir, lines, ports, engine, send_window):
+    config = configparser.ConfigParser()
+    config.read(BASE_CONFIG)
+    sub_dirs = [f"{i + 1:02d}" for i in range(lines)]
+    config['Source'].update({
+        'Source_Dir': os.path.join(base_dir, 'MCOut'), 'Source_Sub_Dir': ','.join(sub_dirs),
+        'File_Types': ','.join(['CSV'] * lines), 'Target_Dir': os.path.join(base_dir, 'MCOutMoved'),
+        'Log_Dir': os.path.join(base_dir, 'Log'), 'Zip_Dir': os.path.join(base_dir, 'MCOutZip'),
+        'Move_File': '1', 'Log_Activity': '0', 'Polling_Interval': '1', 'Stable_Time': '0',
+        'Engine': engine, 'Event_Log': '1'})
+    config['HSC_Server'].update({
+        'HSC_Address': '127.0.0.1', 'HSC_Port': ','.join(map(str, ports)), 'Send_Window': str(send_window),
+        'Machine_Names': ','.join(f"SPI {sub_dir}" for sub_dir in sub_dirs), 'Machine_Types': ','.join(['CKD'] * lines)})
+    for sub_dir in sub_dirs:
+        os.makedirs(os.path.join(base_dir, 'MCOut', sub_dir), exist_ok=True)
+    path = os.path.join(base_dir, 'setting.ini')
+    with open(path, 'w') as f:
+        config.write(f)
+    return path, [os.path.join(base_dir, 'MCOut', sub_dir) for sub_dir in sub_dirs], os.path.join(base_dir, 'Log', 'events')
+
+def process_usage(pid):
+    # (CPU seconds, peak RSS in MB) of a process, None when it cannot be measured here
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            cpu = process.cpu_times()
+            memory = process.memory_info()
+            return cpu.user + cpu.system, getattr(memory, 'peak_wset', memory.rss) / 1e6
+        except psutil.Error:
+            return None, None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        with open(f"/proc/{pid}/status") as f:
+            peak = [line for line in f if line.startswith('VmHWM:')]
+        return cpu, int(peak[0].split()[1]) / 1024 if peak else None
+    except (OSError, ValueError, IndexError):
+        return None, None
+
+def read_events(event_dir):
+    records = []
+    for path in sorted(glob.glob(os.path.join(event_dir, 'events_*.jsonl'))):
+        with open(path, 'rb') as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+def count_events(event_dir):
+    count = 0
+    for path in glob.glob(os.path.join(event_dir, 'events_*.jsonl')):
+        with open(path, 'rb') as f:
+            count += sum(1 for _ in f)
+    return count
+
+def percentile(values, percent):
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(len(values) * percent / 100) - 1))]
+
+########### Scenario ##########
+
+def run_scenario(lines, rate, delay_ms, backlog, duration, profile, engine, send_window, timeout, seed, keep):
+    base_dir = tempfile.mkdtemp(prefix='spi_load_')
+    ports = free_ports(lines)
+    config_path, line_dirs, event_dir = write_config(base_dir, lines, ports, engine, send_window)
+
+    server = start_fake_server(base_dir, ports, delay_ms)
+    writer = FileWriter(line_dirs, seed)
+    for _ in range(backlog * lines):
+        writer.write_one()  # Backlog : already there when the middleware starts
+
+    service = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Middleware_Service.py')
+    middleware = subprocess.Popen([sys.executable, service, '--config', config_path, '--status-port', '0'],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    started = time.monotonic()
+    stop_event = threading.Event()
+    generator = threading.Thread(target=writer.run, args=(rate, duration, profile, stop_event), daemon=True)
+    generator.start()
+    generator.join()
+
+    # Wait until every file has its upload record (or timeout)
+    deadline = time.monotonic() + timeout
+    while count_events(event_dir) < writer.written and time.monotonic() < deadline and middleware.poll() is None:
+        time.sleep(0.2)
+    elapsed = time.monotonic() - started
+    cpu, rss = process_usage(middleware.pid)
+
+    stop_process(middleware)
+    stop_process(server)
+
+    records = read_events(event_dir)
+    latencies = sorted((record['acked'] - record['written']) * 1000 for record in records if record['written'] and record['acked'])
+    acked = [record['acked'] for record in records if record['acked']]
+    result = {
+        'engine': engine, 'lines': lines, 'rate': rate, 'profile': profile, 'delay_ms': delay_ms, 'backlog': backlog, 'duration': duration,
+        'send_window': send_window, 'files': writer.written, 'uploaded': len(records), 'complete': len(records) >= writer.written,
+        'elapsed_s': round(elapsed, 2),
+        'throughput': round(len(acked) / (max(acked) - min(acked)), 1) if len(acked) > 1 and max(acked) > min(acked) else None,
+        'latency_ms': {'p50': percentile(latencies, 50), 'p99': percentile(latencies, 99), 'max': latencies[-1] if latencies else None},
+        'cpu_s': cpu, 'cpu_percent': round(cpu * 100 / elapsed, 1) if cpu is not None else None,
+        'rss_mb': round(rss, 1) if rss is not None else None,
+    }
+    for key in ('p50', 'p99', 'max'):
+        if result['latency_ms'][key] is not None:
+            result['latency_ms'][key] = round(result['latency_ms'][key], 1)
+    if not keep:
+        shutil.rmtree(base_dir, ignore_errors=True)
+    else:
+        result['dir'] = base_dir
+    return result
+
+def main(argv=None):
+    numbers = lambda cast: (lambda text: [cast(value) for value in text.split(',')])
+    parser = argparse.ArgumentParser(description="SPI Middleware load test on loopback, JSON report")
+    parser.add_argument('--lines', type=numbers(int), default=[8], help="Numbers of lines to sweep, e.g. 1,8,60")
+    parser.add_argument('--rate', type=numbers(float), default=[50.0], help="Files per second (all lines together)")
+    parser.add_argument('--delay', type=numbers(int), default=[0], help="HSC response delays in ms")
+    parser.add_argument('--backlog', type=numbers(int), default=[0], help="Files per line already waiting at start")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds of generation per scenario")
+    parser.add_argument('--profile', choices=['constant', 'poisson', 'bursty'], default='constant', help="Arrivals, see 2_CSVFile_Writer.py")
+    parser.add_argument('--engine', choices=['thread', 'async'], default='thread')
+    parser.add_argument('--send-window', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=60.0, help="Max seconds to wait for the last ACKs")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help="Keep the temp folders (logs, events)")
+    parser.add_argument('--out', help="Write the JSON report here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))  # BASE_CONFIG, FAKE_SERVER_CONFIG and the scripts
+    results = []
+    for lines, rate, delay_ms, backlog in itertools.product(args.lines, args.rate, args.delay, args.backlog):
+        print(f"lines={lines} rate={rate}/s delay={delay_ms} ms backlog={backlog} ...", file=sys.stderr)
+        results.append(run_scenario(lines, rate, delay_ms, backlog, args.duration, args.profile, args.engine, args.send_window, args.timeout, args.seed, args.keep))
+        print(json.dumps(results[-1]), file=sys.stderr)
+
+    report = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
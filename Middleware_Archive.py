@@ -0,0 +1,412 @@
+# Background archival stage. After an ACK the worker only hands the file over to the
+# Archiver and goes on uploading; one thread per engine moves (Move_File = 1), deletes
+# (Move_File = 0) or bundles (Move_File = 2) the files in batches :
+#   - target folders of a batch are created once (and remembered),
+#   - a move is a plain os.replace within the same filesystem, copy + fsync + remove
+#     only when the target is on another device,
+#   - a file still locked by the machine (PermissionError on Windows) is retried later
+#     with a growing delay instead of time.sleep() in the upload path; the other files
+#     of the batch are not held up by it.
+# Files waiting here are reported by is_pending() so the scans don't upload them again.
+#
+# Move_File = 2 : instead of millions of small files in Target_Dir, the files are stored in
+# compressed bundles in Zip_Dir, one per hour or per day (<Zip_Dir>/20240131_14.zip). The
+# bundle is filled as <name>.tmp while the sources stay in place (still pending here), and
+# sealed (closed, fsync'ed, renamed, indexed, then the sources deleted) at the end of the
+# hour/day, at Zip_Max_MB (next part 20240131_14_2.zip ...), after Zip_Seal_Minutes if set,
+# and on stop. A sealed bundle is never modified : a crash only loses the .tmp, whose
+# sources are still there and archived again (Outbox recover) at the next start.
+# Each member keeps its path relative to Target_Dir (01/SN..._OK.csv, 07/2024/report.xml)
+# and <Zip_Dir>/index.db maps the serial to (bundle, member).
+#   > python Middleware_Archive.py SERIAL [--extract DIR]
+import argparse
+import errno
+import heapq
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import zipfile
+from collections import deque
+
+RETRY_MIN = 0.2    # Seconds before the first retry of a locked file
+RETRY_MAX = 30.0   # Cap of the retry delay, a locked file is retried forever
+BATCH_SIZE = 256   # Max files per batch
+HELD = object()    # Result of a file written into the open bundle, done once the bundle is sealed
+
+ROTATE_FORMATS = {'hour': '%Y%m%d_%H', 'day': '%Y%m%d'}  # Bundle name per [Source] Zip_Rotate
+
+class ZipBundles:
+    def __init__(self, zip_dir, target_dir, rotate='hour', max_bytes=256 * 1024 * 1024, max_age=0):
+        if rotate not in ROTATE_FORMATS:
+            raise ValueError(f"Zip_Rotate = {rotate} : use hour or day")
+        os.makedirs(zip_dir, exist_ok=True)
+        self.zip_dir = zip_dir
+        self.target_dir = target_dir
+        self.stamp_format = ROTATE_FORMATS[rotate]
+        self.max_bytes = max_bytes
+        self.max_age = max_age  # Seconds a bundle stays open at most, 0 = until the end of its hour/day
+        self.part = (None, 0)  # (stamp, number) of the last part opened
+        self.bundle = None     # (name, ZipFile) of the open part, written as <name>.tmp
+        self.rows = []         # Index rows of the members of the open part
+        self.written = 0       # Bytes added to the open part
+        self.seal_at = None    # time.monotonic() the open part is due
+        self.lock = threading.Lock()  # lookup() may come from another thread
+
+        self.index = sqlite3.connect(os.path.join(zip_dir, 'index.db'), check_same_thread=False)
+        self.index.execute("PRAGMA journal_mode=WAL")
+        self.index.execute("""CREATE TABLE IF NOT EXISTS bundle_index (
+            serial TEXT,
+            member TEXT NOT NULL,
+            bundle TEXT NOT NULL,
+            size INTEGER,
+            archived REAL)""")
+        self.index.execute("CREATE INDEX IF NOT EXISTS bundle_serial ON bundle_index(serial)")
+        self.index.commit()
+
+    def _next_part(self):
+        # First free part name of the current hour/day
+        stamp = time.strftime(self.stamp_format)
+        part = self.part[1] if self.part[0] == stamp else 0
+        while True:
+            part += 1
+            name = f"{stamp}.zip" if part == 1 else f"{stamp}_{part}.zip"
+            if not os.path.exists(os.path.join(self.zip_dir, name)):
+                self.part = (stamp, part)
+                return name
+
+    def drop_unsealed(self):
+        # Bundles left open by a crash : their sources were kept, they are archived again
+        for name in os.listdir(self.zip_dir):
+            if name.endswith('.zip.tmp'):
+                os.remove(os.path.join(self.zip_dir, name))
+
+    def _open(self):
+        name = self._next_part()
+        self.bundle = (name, zipfile.ZipFile(os.path.join(self.zip_dir, name + '.tmp'), 'w', zipfile.ZIP_DEFLATED))
+        self.rows = []
+        self.written = 0
+        now = time.localtime()
+        period_left = 3600 - now.tm_min * 60 - now.tm_sec
+        if self.stamp_format == ROTATE_FORMATS['day']:
+            period_left += (23 - now.tm_hour) * 3600
+        self.seal_at = time.monotonic() + (min(period_left, self.max_age) if self.max_age > 0 else period_left)
+
+    def add(self, source, target, serial):
+        # Write one file into the open bundle : True = written (the source goes once sealed),
+        # None = source gone, OSError = retry later. Raises OSError when the bundle cannot be opened
+        if self.bundle is None:
+            self._open()
+        name, bundle = self.bundle
+        member = os.path.relpath(target, self.target_dir).replace(os.sep, '/')
+        try:
+            size = os.path.getsize(source)
+            bundle.write(source, member)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            return e
+        self.written += size
+        self.rows.append((serial, member, name, size, time.time()))
+        return True
+
+    def seal_in(self):
+        # Seconds until the open bundle must be sealed, None when none is open
+        if self.bundle is None:
+            return None
+        if self.written >= self.max_bytes or time.strftime(self.stamp_format) != self.part[0]:
+            return 0.0
+        return max(0.0, self.seal_at - time.monotonic())
+
+    def seal(self):
+        # Close the open bundle and make it final; its members are on disk and indexed when this
+        # returns. On OSError the bundle is dropped and its files must be added again
+        if self.bundle is None:
+            return
+        (name, bundle), self.bundle = self.bundle, None
+        temp_path = os.path.join(self.zip_dir, name + '.tmp')
+        try:
+            bundle.close()
+            if not self.rows:
+                os.remove(temp_path)  # Nothing could be read for it
+                return
+            with open(temp_path, 'rb+') as f:
+                os.fsync(f.fileno())  # On disk before any source is deleted
+            os.replace(temp_path, os.path.join(self.zip_dir, name))
+            if os.name != 'nt':
+                dir_fd = os.open(self.zip_dir, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)  # The rename too
+                finally:
+                    os.close(dir_fd)
+        except OSError:
+            # Disk full, Zip_Dir gone ... : nothing is indexed
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        with self.lock:
+            self.index.executemany("INSERT INTO bundle_index (serial, member, bundle, size, archived) VALUES (?, ?, ?, ?, ?)", self.rows)
+            self.index.commit()
+
+    def lookup(self, serial):
+        # [(bundle, member, archived time)] of a serial, oldest first
+        with self.lock:
+            return self.index.execute("SELECT bundle, member, archived FROM bundle_index WHERE serial=? ORDER BY rowid",
+                                      (serial,)).fetchall()
+
+    def read(self, bundle, member):
+        with zipfile.ZipFile(os.path.join(self.zip_dir, bundle)) as z:
+            return z.read(member)
+
+    def close(self):
+        if self.bundle is not None:
+            self.bundle[1].close()  # Not sealed : removed at the next start, the sources are still there
+            self.bundle = None
+        with self.lock:
+            self.index.close()
+
+class Archiver:
+    def __init__(self, move_file, bundles=None):
+        self.move_file = move_file
+        self.bundles = bundles   # ZipBundles when Move_File = 2
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.incoming = deque()  # (source, target, make_dirs, serial, on_done, attempts)
+        self.retries = []        # Heap of (due time, sequence, item) for locked files
+        self.pending = set()     # Source paths not archived yet
+        self.known_dirs = set()  # Target folders already created
+        self.sequence = 0
+        self.held = []           # Items written into the open bundle, done when it is sealed
+        self.running = False
+        self.thread = None
+        self.archived = 0        # Counters for the statistics
+        self.retried = 0
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True, name="archiver")
+        self.thread.start()
+
+    def submit(self, source, target, make_dirs=False, on_done=None, serial=None):
+        # Never blocks : on_done() is called from the archiver thread once the file is moved/deleted/bundled
+        with self.lock:
+            self.pending.add(source)
+            self.incoming.append((source, target, make_dirs, serial, on_done, 0))
+            self.changed.notify()
+
+    def is_pending(self, source):
+        with self.lock:
+            return source in self.pending
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+    def stop(self, timeout=5.0):
+        # Finish what can be done now; locked files stay in place and are found again at the next start
+        with self.lock:
+            self.running = False
+            self.changed.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+        if self.bundles is not None:
+            self.bundles.close()
+
+    ### Archiver thread ###
+
+    def _take_batch(self):
+        # Wait for work, return the items that can be processed now (None when stopped)
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                while self.retries and (self.retries[0][0] <= now or not self.running):
+                    self.incoming.append(heapq.heappop(self.retries)[2])
+                if self.incoming:
+                    batch = []
+                    while self.incoming and len(batch) < BATCH_SIZE:
+                        batch.append(self.incoming.popleft())
+                    return batch
+                if not self.running:
+                    return None
+                timeout = self.retries[0][0] - now if self.retries else None
+                seal_in = self.bundles.seal_in() if self.bundles is not None else None
+                if seal_in is not None:
+                    if seal_in <= 0:
+                        return []  # Nothing new, the open bundle is due
+                    timeout = seal_in if timeout is None else min(timeout, seal_in)
+                self.changed.wait(timeout)
+
+    def _move(self, source, target):
+        try:
+            os.replace(source, target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # Other device : copy, flush to disk, then drop the source
+            temp_target = target + '.part'
+            with open(source, 'rb') as src, open(temp_target, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+                dst.flush()
+                os.fsync(dst.fileno())
+            shutil.copystat(source, temp_target)
+            os.replace(temp_target, target)
+            os.remove(source)
+
+    def _archive(self, source, target):
+        # Move or delete one file, raises OSError when it must be retried
+        try:
+            if self.move_file == 1:
+                self._move(source, target)
+            else:
+                os.remove(source)
+        except FileNotFoundError:
+            if os.path.exists(source):
+                raise  # The target folder is missing, not the file
+
+    def _archive_batch(self, batch):
+        # One result per item : None when done, the OSError when it must be retried, HELD when in the open bundle
+        if self.bundles is not None:
+            results = []
+            for item in batch:
+                seal_in = self.bundles.seal_in()
+                if seal_in is not None and seal_in <= 0:
+                    self._seal()
+                try:
+                    stored = self.bundles.add(item[0], item[1], item[3])
+                except OSError as e:  # Zip_Dir not writable, disk full ...
+                    stored = e
+                if stored is True:
+                    self.held.append(item)
+                    stored = HELD
+                results.append(stored)
+            return results
+
+        if self.move_file == 1:
+            # One makedirs per new target folder for the whole batch
+            for folder in {os.path.dirname(item[1]) for item in batch if item[2]} - self.known_dirs:
+                try:
+                    os.makedirs(folder, exist_ok=True)
+                    self.known_dirs.add(folder)
+                except OSError as e:
+                    print(f"Cannot create {folder} ({e})")
+
+        results = []
+        for source, target, make_dirs, serial, on_done, attempts in batch:
+            try:
+                self._archive(source, target)
+                results.append(None)
+            except OSError as e:
+                self.known_dirs.discard(os.path.dirname(target))  # Maybe removed, created again next time
+                results.append(e)
+        return results
+
+    def _seal(self):
+        # Seal the open bundle, then its sources can go
+        held, self.held = self.held, []
+        try:
+            self.bundles.seal()
+        except OSError as e:
+            print(f"Archive failed ({e}), retrying in the background")
+            for item in held:
+                self._finish(item, e)
+            return
+        for item in held:
+            error = None
+            try:
+                os.remove(item[0])  # Safe now : in the bundle and in the index
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                error = e  # Stored again on the retry, the index points to both copies
+            self._finish(item, error)
+
+    def _finish(self, item, error):
+        source, target, make_dirs, serial, on_done, attempts = item
+        if error is not None and attempts == 0:
+            print(f"File is in use ({error}), retrying in the background")
+
+        with self.lock:
+            if error is None:
+                self.pending.discard(source)
+                self.archived += 1
+            elif self.running:
+                delay = min(RETRY_MAX, RETRY_MIN * 2 ** attempts)
+                self.sequence += 1
+                heapq.heappush(self.retries, (time.monotonic() + delay, self.sequence,
+                                              (source, target, make_dirs, serial, on_done, attempts + 1)))
+                self.retried += 1
+            else:
+                self.pending.discard(source)  # Stopping : left in place for the next start
+
+        if error is None and on_done is not None:
+            on_done()
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                break
+
+            try:
+                results = self._archive_batch(batch)
+            except OSError as e:  # Zip_Dir not writable, disk full ... : the whole batch is retried
+                print(f"Archive failed ({e}), retrying in the background")
+                results = [e] * len(batch)
+
+            for item, error in zip(batch, results):
+                if error is not HELD:
+                    self._finish(item, error)
+
+            if self.bundles is not None:
+                seal_in = self.bundles.seal_in()
+                if seal_in is not None and seal_in <= 0:
+                    self._seal()
+
+        if self.bundles is not None:
+            self._seal()  # Stopping : the open bundle is sealed, its sources deleted
+
+# Started Archiver from read_settings(), with the Zip_Dir bundles when Move_File = 2
+def open_archiver(settings):
+    bundles = None
+    if settings['Move_File'] == 2:
+        bundles = ZipBundles(settings['Zip_Dir'], settings['Target_Dir'], settings['Zip_Rotate'], settings['Zip_Max_MB'] * 1024 * 1024,
+                             settings['Zip_Seal_Minutes'] * 60)
+        bundles.drop_unsealed()
+    archiver = Archiver(settings['Move_File'], bundles)
+    archiver.start()
+    return archiver
+
+# Serial of an uploadData line (\x02uploadData;event_id;0;1;serial;...), None if it is not one
+def upload_serial(data):
+    fields = data.split(';')
+    return fields[4] if len(fields) > 4 else None
+
+if __name__ == "__main__":
+    from Middleware_Helper import read_settings
+
+    parser = argparse.ArgumentParser(description="Find the archived result files of a serial in the Zip_Dir bundles")
+    parser.add_argument('serial')
+    parser.add_argument('--extract', metavar='DIR', help="Write the files found into DIR")
+    parser.add_argument('--ini', default='1_SPI_Middleware_setting.ini')
+    args = parser.parse_args()
+
+    settings = read_settings(args.ini)
+    bundles = ZipBundles(settings['Zip_Dir'], settings['Target_Dir'], settings['Zip_Rotate'])
+    found = bundles.lookup(args.serial)
+    for bundle, member, archived in found:
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(archived))}  {bundle}  {member}")
+        if args.extract:
+            out_path = os.path.join(args.extract, bundle[:-4], *member.split('/'))
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, 'wb') as f:
+                f.write(bundles.read(bundle, member))
+    if not found:
+        print(f"{args.serial} : not found in {settings['Zip_Dir']}")
+    bundles.close()
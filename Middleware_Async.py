@@ -0,0 +1,509 @@
+# Asyncio engine : all machines run as coroutines on ONE event loop instead of one
+# OS thread (+ blocking socket + time.sleep) per Source_Sub_Dir entry.
+# Sockets are asyncio streams, directory scans / XML parsing run in a small bounded
+# thread pool and file moves in the background Archiver, so 60+ lines fit in a single process.
+#
+# Select it with [Source] Engine = async. It runs headless (run()) or next to the
+# Tk GUI (start() runs the loop in a background thread). [Source] Outbox = 1 journals
+# every upload in the same SQLite outbox as the thread engine.
+import asyncio
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from Middleware_Helper import DirectoryIndex, TreeScanner, ReadinessGate, parse_filename, determine_serial_state
+from Middleware_Helper import machine_state, log_event, print_log, print_status
+from Middleware_Archive import open_archiver, upload_serial
+from Middleware_Log import configure_logs, close_logs
+from Middleware_Events import open_event_log, new_trace
+from Middleware_Stats import MachineStats
+from Middleware_Watcher import create_watcher
+from Middleware_Sender import ResponseReader, match_ack
+from Middleware_Outbox import open_outbox, PendingRows
+from Middleware_State import open_event_state
+from Middleware_Connection import CONNECTED, RECONNECTING, OFFLINE, CONNECT_TIMEOUT, create_backoff
+from Middleware_Xml import open_parse_pool, parse_records, sort_by_mtime
+
+ACK_TIMEOUT = 10.0     # Max wait for the next ACK before the link is declared dead
+STATUS_INTERVAL = 1.0  # Seconds between two status reports
+
+class Machine:
+    # Runtime state of one line, same fields the GUI keeps in its machine_* lists
+    def __init__(self, idx, name, file_type, source_dir, target_dir, port):
+        self.idx = idx
+        self.name = name
+        self.file_type = file_type
+        self.source_dir = source_dir
+        self.target_dir = target_dir
+        self.port = port
+        self.status = "Unknown"
+        self.updated = datetime.now()
+        self.event_state = None  # EventIdState, opened by AsyncMiddleware.main()
+        self.pending = None      # PendingRows (outbox rows not acknowledged yet), loaded by run_machine()
+        self.stream_reader = None
+        self.stream_writer = None
+        self.acks = deque()  # Framed answers not matched yet
+        self.response_reader = ResponseReader()
+        self.index = DirectoryIndex(source_dir, '.csv') if file_type == 'CSV' else None
+        self.scanner = None  # TreeScanner of an XML line, created by AsyncMiddleware
+        self.gate = None     # ReadinessGate, created by AsyncMiddleware
+        self.watcher = None
+        self.backoff = None      # Reconnect policy (Middleware_Connection.Backoff)
+        self.link_state = None   # CONNECTED / RECONNECTING / OFFLINE
+        self.link_lost = None    # asyncio.Event, set by run_machine when sending failed
+        self.link_up = None      # asyncio.Event, set when the link is back (flush the queue now)
+        self.stats = MachineStats()  # Stage latencies and counters
+
+class AsyncMiddleware:
+    def __init__(self, settings, on_status=print_status, on_log=print_log):
+        self.settings = settings
+        self.on_status = on_status  # on_status(idx, name, status, color, elapsed_time)
+        self.on_log = on_log        # on_log(log_type, message1, message2="") like log_message in the GUI
+        self.executor = ThreadPoolExecutor(max_workers=max(1, settings['File_Workers']), thread_name_prefix="file_io")
+        self.loop = None
+        self.thread = None
+        self._stop = None
+        self._stop_requested = threading.Event()  # stop() may come before the loop is running
+        self.outbox = None  # Opened by main()
+        self.parse_pool = None  # XML parse processes ([Source] Parse_Workers), opened by main()
+        self.archiver = None  # Background move/delete of the acknowledged files, started by main()
+        self.event_log = None  # Structured upload log ([Source] Event_Log), opened by main()
+
+        self.machines = []
+        for idx, sub_dir in enumerate(settings['Source_Sub_Dir']):
+            os.makedirs(os.path.join(settings['Target_Dir'], sub_dir), exist_ok=True)  # Ensure target directory exists
+            self.machines.append(Machine(
+                idx, settings['Machine_Names'][idx], settings['File_Types'][idx],
+                os.path.join(settings['Source_Dir'], sub_dir), os.path.join(settings['Target_Dir'], sub_dir),
+                settings['HSC_Ports'][idx]))
+            self.machines[-1].gate = ReadinessGate(settings['Stable_Time'], settings['Polling_Interval'])
+            if settings['File_Types'][idx] == 'XML':
+                self.machines[-1].scanner = TreeScanner(self.machines[-1].source_dir, '.xml', settings['Prune_Empty_Dirs'])
+
+    ### Blocking helpers, run in the executor ###
+
+    def _io(self, func, *args):
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    def _journal(self, m, file_path, event_id, data):
+        if m.pending is None:
+            return None
+        return m.pending.add(file_path, event_id, data)
+
+    def _journaled(self, m, file_path):
+        # In the outbox and not acknowledged : sent by _pending_messages(), not parsed again
+        return m.pending is not None and file_path in m.pending
+
+    def _pending_messages(self, m):
+        # Parsed before (outage, NACK, restart) and not acknowledged : sent first, straight from the
+        # outbox with the event id of the first attempt, context = (file_name, None, outbox row, trace)
+        if m.pending is None:
+            return []
+        detected = time.monotonic()
+        messages = []
+        for path, (row_id, event_id, data) in m.pending.take():
+            if self.archiver.is_pending(path):
+                continue  # Acknowledged, still waiting to be moved
+            file_name = os.path.basename(path) if m.file_type == 'CSV' else path
+            messages.append((event_id, data, (file_name, None, row_id, new_trace(detected))))
+        return messages
+
+    def _scan_csv(self, m):
+        # (event_id, data, context) for new CSV files, oldest first, context = (file_name, mtime, outbox row, trace)
+        detected = time.monotonic()
+        m.index.refresh()
+        messages = []
+        ready = lambda name: not self.archiver.is_pending(os.path.join(m.source_dir, name)) and m.gate.is_ready(os.path.join(m.source_dir, name))
+        for file_name, mtime in m.index.drain(ready):  # Acknowledged files waiting to be moved are held back too
+            file_path = os.path.join(m.source_dir, file_name)
+            if self._journaled(m, file_path):
+                continue  # Resent from the outbox by _pending_messages()
+            trace = new_trace(detected, mtime)
+            serial, datetime_part, result = parse_filename(file_name)
+            if not serial or not datetime_part or not result:
+                self.on_log(0, f"Skipping invalid file name : {file_name}")
+                m.stats.count('skipped')
+                continue
+            serial_nr_state = determine_serial_state(result, self.settings['CSV_Result_0'])
+            event_id = m.event_state.take()  # Looping back to 1 after 9999, kept across restarts
+            data = f"\x02uploadData;{event_id};0;1;{serial};1;{serial_nr_state};0;\x0D\x0A"
+            trace['parsed'] = time.monotonic()
+            m.stats.parsed(trace)
+            messages.append((event_id, data, (file_name, mtime, self._journal(m, file_path, event_id, data), trace)))
+        return messages
+
+    def _scan_xml(self, m):
+        # (event_id, data, context) for every XML file in the tree, event_id comes from the file
+        detected = time.monotonic()
+        messages = []
+        new_files = []
+        for file_name in m.scanner.scan(m.gate.failed_paths()):  # Broken files fixed in place get their new mtime
+            if self.archiver.is_pending(file_name) or self._journaled(m, file_name):
+                continue  # Acknowledged and waiting to be moved, or resent from the outbox by _pending_messages()
+            new_files.append(file_name)
+
+        mtimes = m.scanner.mtimes  # From the listings, no stat per file and per cycle
+        new_files = m.gate.ready(sort_by_mtime(new_files, mtimes))  # Completely written and not known as broken
+        if self.parse_pool is not None:
+            records = self.parse_pool.parse(new_files)  # Parse stage in the process pool, same order
+        else:
+            records = parse_records(self.settings['XML_Plan'], new_files)
+        for file_name, mtime, event_id, serial, result in records:
+            if not serial or not event_id or not result or "N/A" in (event_id, serial, result):
+                self.on_log(0, f"Skipping invalid file name : {file_name}")
+                m.status = "File_issue"
+                m.stats.count('skipped')
+                m.gate.parse_failed(file_name)  # Not parsed again until the file changes
+                continue
+            serial_nr_state = determine_serial_state(result, self.settings['XML_Result_0'])
+            data = f"\x02uploadData;{event_id};0;1;{serial};1;{serial_nr_state};0;\x0D\x0A"
+            trace = new_trace(detected, mtime)
+            trace['parsed'] = time.monotonic()
+            m.stats.parsed(trace)
+            messages.append((event_id, data, (file_name, None, self._journal(m, file_name, event_id, data), trace)))
+        return messages
+
+    def _archive(self, m, file_name, event_id, data, row_id, trace, response):
+        # The outbox row is committed as acked BEFORE the file is handed to the archiver,
+        # it is marked archived (and logged in the upload log) once the file is really moved/deleted
+        outbox = self.outbox if row_id is not None else None
+        event_log, serial = self.event_log, upload_serial(data)
+        source_file = os.path.join(m.source_dir, file_name) if m.file_type == 'CSV' else file_name
+        if outbox is not None:
+            outbox.acked(row_id, response)
+            m.pending.discard(source_file)
+
+        def on_done():
+            trace['archived'] = time.monotonic()
+            m.stats.archived(trace)
+            if outbox is not None:
+                outbox.archived(row_id)
+            if event_log is not None:
+                event_log.record(m.name, serial, event_id, source_file, trace, response)
+
+        if m.file_type == 'CSV':
+            self.archiver.submit(source_file, os.path.join(m.target_dir, file_name), False, on_done, serial)
+            m.index.discard(file_name)
+        else:
+            relative_path = os.path.relpath(file_name, m.source_dir)
+            self.archiver.submit(source_file, os.path.join(m.target_dir, relative_path), True, on_done, serial)
+
+    def _recover(self, m):
+        # Files acknowledged before the last stop/crash are archived, not sent twice
+        if self.outbox is None:
+            return 0
+        def archive(path, data, on_done):
+            if m.file_type == 'CSV':
+                self.archiver.submit(path, os.path.join(m.target_dir, os.path.basename(path)), False, on_done, upload_serial(data))
+            else:
+                self.archiver.submit(path, os.path.join(m.target_dir, os.path.relpath(path, m.source_dir)), True, on_done, upload_serial(data))
+        recovered = self.outbox.recover(m.name, archive)
+        m.pending = PendingRows(self.outbox, m.name)
+        return recovered
+
+    ### Connection ###
+
+    def _link_state(self, m, state, wait):
+        # Same messages / statuses as ThreadMiddleware.connect()
+        old, m.link_state = m.link_state, state
+        if old == state:
+            return
+        address = self.settings['HSC_Address']
+        if state == CONNECTED:
+            self.on_log(1, f"Connected [{address}:{m.port}] <-- {m.source_dir}")
+            m.status = "Unknown"  # Back to normal, OK again with the next ACK
+            return
+        if old is None:
+            self.on_log(0, f"Failed to establish connection to {address}:{m.port}, retrying in background")
+        elif old == CONNECTED:
+            self.on_log(0, f"DISconnected [{address}:{m.port}]")
+        elif state == OFFLINE:
+            self.on_log(0, f"{address}:{m.port} still down, next try in {wait:.0f} s")
+        m.status = state
+
+    async def _keep_connected(self, m):
+        # Background (re)connection of one machine : jittered exponential backoff + circuit breaker
+        address = self.settings['HSC_Address']
+        while not self._stop.is_set():
+            if m.stream_writer is not None:
+                await self._sleep(None, m.link_lost)  # Link is up, nothing to do until sending fails
+                m.link_lost.clear()
+                continue
+
+            try:
+                m.stream_reader, m.stream_writer = await asyncio.wait_for(asyncio.open_connection(address, m.port), CONNECT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError) as e:
+                wait = m.backoff.failure()
+                print(f"Attempt {m.backoff.failures}: Error connecting to {address}:{m.port} - {e or 'timeout'}, next attempt in {wait:.1f} s")
+                self._link_state(m, m.backoff.state(), wait)
+                await self._sleep(wait)
+                continue
+
+            m.backoff.success()
+            m.response_reader = ResponseReader()
+            m.acks.clear()
+            self._link_state(m, CONNECTED, None)
+            m.link_up.set()
+
+    def _close(self, m):
+        if m.stream_writer is not None:
+            m.stream_writer.close()
+        m.stream_reader = m.stream_writer = None
+
+    async def _next_ack(self, m):
+        while not m.acks:
+            chunk = await asyncio.wait_for(m.stream_reader.read(4096), ACK_TIMEOUT)
+            if not chunk:
+                raise ConnectionError("Connection closed by server")
+            m.acks.extend(m.response_reader.feed(chunk))
+        return m.acks.popleft()
+
+    ### Per machine coroutine ###
+
+    async def _send(self, m, messages):
+        # Pipelined send of one batch, returns the same tuples as PipelinedSender.pipeline()
+        window = max(1, self.settings['Send_Window'])
+        in_flight = deque()  # (event_id, data, context, send time, position in messages)
+        results = []
+        answered = set()     # Positions that already have a result
+
+        async def collect():
+            message = await self._next_ack(m)
+            pos = match_ack(message, in_flight)
+            if pos is None:
+                print(f"Answer for event id {message.event_id} which is not in flight, discarded : {message.text}")
+                return
+            event_id, data, context, sent, position = in_flight[pos]
+            del in_flight[pos]
+            answered.add(position)
+            results.append((event_id, data, context, message.text, message.ok, message.received - sent))
+
+        try:
+            if m.stream_writer is None:
+                raise ConnectionError("No active connection")
+            for position, (event_id, data, context) in enumerate(messages):
+                if self._stop.is_set():
+                    break  # Stopping : the rest stays in place (and in the outbox) for the next start
+                while len(in_flight) >= window:
+                    await collect()
+                m.stream_writer.write(data.encode('utf-8'))
+                await m.stream_writer.drain()
+                in_flight.append((event_id, data, context, time.monotonic(), position))
+                context[3]['sent'] = in_flight[-1][3]
+                if self.outbox is not None and context[2] is not None:
+                    self.outbox.sent(context[2])  # Lazy commit, no disk wait on the loop
+            while in_flight:
+                await collect()
+        except (OSError, ConnectionError, asyncio.TimeoutError) as e:
+            # Everything not acknowledged fails and stays in place for the next cycle
+            reason = str(e) or type(e).__name__
+            for position, (event_id, data, context) in enumerate(messages):
+                if position not in answered:
+                    results.append((event_id, data, context, reason, False, None))
+        return results
+
+    async def _wait_for_files(self, m):
+        # Wake up on a watcher event, the link coming back, stop() or after Polling_Interval
+        timeout = m.gate.wait_time(self.settings['Polling_Interval'])
+        if m.watcher.backend != "inotify":
+            await self._sleep(timeout, m.link_up)
+            m.link_up.clear()
+            return
+
+        event = asyncio.Event()
+        def on_readable():
+            found = m.watcher.read_events()
+            m.gate.watch_events(m.watcher)  # Created = still being written, closed = complete
+            if found:
+                event.set()
+        self.loop.add_reader(m.watcher.fd, on_readable)
+        try:
+            await self._sleep(timeout, event, m.link_up)
+        finally:
+            self.loop.remove_reader(m.watcher.fd)
+        m.link_up.clear()
+
+    async def _sleep(self, timeout, *events):
+        waiters = [self.loop.create_task(self._stop.wait())]
+        for event in events:
+            waiters.append(self.loop.create_task(event.wait()))
+        done, pending = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+
+    async def run_machine(self, m):
+        address = self.settings['HSC_Address']
+        m.backoff = create_backoff(self.settings)
+        m.link_lost = asyncio.Event()
+        m.link_up = asyncio.Event()
+        link = self.loop.create_task(self._keep_connected(m))  # Never blocks this loop, files keep coming in
+
+        recovered = await self._io(self._recover, m)
+        if recovered:
+            self.on_log(1, f"{m.name} : {recovered} file(s) acknowledged before the last stop archived")
+        recursive = m.file_type == 'XML'
+        m.watcher = create_watcher([m.source_dir], self.settings['Watch_Mode'], recursive=recursive,
+                                   extensions=['.xml'] if recursive else ['.csv'])
+
+        try:
+            while not self._stop.is_set():
+                online = m.stream_writer is not None
+                if not online and self.outbox is None:
+                    await self._wait_for_files(m)  # Files stay queued on disk until the link is back
+                    continue
+
+                # What the outbox still holds first (no rescan / re-parse), then the new files of the scan
+                messages = await self._io(self._pending_messages, m) if online else []
+                messages += await self._io(self._scan_xml if recursive else self._scan_csv, m)
+                if not online:
+                    # Link down : the files were parsed into the outbox, they go from there as soon as the link is back
+                    await self._wait_for_files(m)
+                    continue
+
+                failed_files = []
+                broken = False
+
+                for event_id, data, (file_name, mtime, row_id, trace), response, success, latency in await self._send(m, messages):
+                    if success:
+                        self.on_log(2, f"{m.name} : ", f"{data[1:-2]}")
+                        m.event_state.acked(event_id)
+                        trace['acked'] = trace['sent'] + latency
+                        m.stats.acked()
+                        await self._io(self._archive, m, file_name, event_id, data, row_id, trace, response)
+                        m.updated = datetime.now()
+                        m.status = "OK"
+                    else:
+                        if latency is None:
+                            broken = True  # No answer : the link is gone
+                        else:  # NACK : the file stays in place and is sent again next cycle
+                            self.on_log(0, f"{m.name} : {file_name} refused by the HSC ({response})")
+                            m.status = "File_issue"
+                        m.stats.count('failed')
+                        if mtime is not None:
+                            failed_files.append((file_name, mtime))
+
+                    if self.settings['Log_Activity'] == 1:
+                        # Same line as the thread engine
+                        event = f"File: {file_name}, Sent: {data}, Response: {response}, Connected: {not broken}, ACK: {'-' if latency is None else round(latency * 1000, 1)} ms"
+                        log_event(self.settings['Log_Dir'], event)  # Queued, written by the log thread
+
+                if m.index is not None:
+                    m.index.requeue(failed_files)
+
+                if broken:  # Reconnect in the background, the failed files are sent again once it is back
+                    self._close(m)
+                    self._link_state(m, RECONNECTING, None)
+                    m.link_lost.set()
+
+                await self._wait_for_files(m)
+        finally:
+            link.cancel()
+            m.watcher.close()
+            self._close(m)
+            self.on_log(1, f"DISconnected [{address}:{m.port}]")
+
+    async def report_status(self):
+        # Same rules as update_rectangles() in the GUI
+        while not self._stop.is_set():
+            for m in self.machines:
+                elapsed_time = (datetime.now() - m.updated).seconds
+                m.status, color = machine_state(m.status, elapsed_time, self.settings['Standby_Time'], self.settings['Unknown_Time'])
+                self.on_status(m.idx, m.name, m.status, color, elapsed_time)
+            await self._sleep(STATUS_INTERVAL)
+
+    async def main(self):
+        self.loop = asyncio.get_event_loop()
+        self._stop = asyncio.Event()
+        if self._stop_requested.is_set():
+            return
+        configure_logs(self.settings)
+        if self.outbox is None:
+            self.outbox = open_outbox(self.settings)
+        if self.parse_pool is None:
+            self.parse_pool = open_parse_pool(self.settings)
+        if self.archiver is None:
+            self.archiver = open_archiver(self.settings)
+        if self.event_log is None:
+            self.event_log = open_event_log(self.settings)
+        for m in self.machines:
+            if m.event_state is None:
+                m.event_state = open_event_state(self.settings, m.name)
+
+        results = await asyncio.gather(self.report_status(), *[self.run_machine(m) for m in self.machines], return_exceptions=True)
+        for m, result in zip(self.machines, results[1:]):
+            if isinstance(result, Exception):  # One broken line must not take the others down
+                self.on_log(0, f"{m.name} stopped : {result}")
+        self.executor.shutdown(wait=True)  # Let the last outbox writes finish
+        self.archiver.stop()  # Before the outbox : the moves that can be done now are marked archived
+        self.archiver = None
+        if self.event_log is not None:
+            self.event_log.close()  # After the archiver : its last records are written
+            self.event_log = None
+        close_logs()  # Write the buffered app_log.txt lines
+        if self.outbox is not None:
+            self.outbox.close()
+            self.outbox = None
+        for m in self.machines:
+            m.event_state.close()
+            m.event_state = None
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+            self.parse_pool = None
+
+    ### Entry points ###
+
+    def run(self):
+        # Headless : blocks until stop() is called from another thread or Ctrl+C
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            pass
+
+    def start(self):
+        # Next to the Tk GUI : the event loop lives in one background thread
+        if self.thread is not None and self.thread.is_alive():
+            self.on_log(0, "The previous run is still stopping, not started")
+            return
+        self._stop_requested.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def _begin_stop(self, timeout):
+        # Loop thread : no new work, the ACKs in flight may still come for timeout seconds
+        self._stop.set()
+        self.loop.call_later(timeout, self._interrupt)
+
+    def _interrupt(self):
+        # Loop thread : end the waits for an ACK now (their connection is closed)
+        for m in self.machines:
+            if m.stream_writer is not None:
+                m.stream_writer.close()
+
+    # True once the loop ended, the outbox / archiver / event states closed with it. False when it
+    # is still tearing down after timeout : a later stop() waits again, start() refuses meanwhile.
+    def stop(self, timeout=2):
+        self._stop_requested.set()
+        loop = self.loop
+        if loop is not None and self._stop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._begin_stop, timeout)
+            except RuntimeError:
+                pass  # Closed in the meantime
+        if self.thread is None:
+            return True
+        self.thread.join(timeout=2 * timeout)
+        if self.thread.is_alive():
+            self.on_log(0, "Still stopping : event loop")
+            return False
+        return True
+
+    def snapshot(self):
+        # Plain dict view of the machine states, e.g. for a status endpoint
+        return [{'name': m.name, 'status': m.status, 'port': m.port,
+                 'elapsed': (datetime.now() - m.updated).seconds,
+                 'last_event_id': m.event_state.last_acked if m.event_state is not None else None,
+                 'stats': m.stats.snapshot()}
+                for m in self.machines]
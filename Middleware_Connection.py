@@ -0,0 +1,129 @@
+# Connection management for one HSC port, the workers never sleep in connect() anymore.
+# A ConnectionManager thread (re)connects in the background with jittered exponential
+# backoff and a circuit breaker; the worker asks for the current socket (None while the
+# link is down), keeps ingesting files meanwhile and is woken up (on_connected) to flush
+# its queue as soon as the link is back.
+#
+#   Connected --(send fails)--> Reconnecting --(Breaker_Failures attempts failed)--> Offline
+#   Offline = breaker open : one probe every Breaker_Cooldown seconds until one succeeds
+# The cooldown is capped at Reconnect_Max : the breaker only makes the probes regular
+# (and the state / log quieter), the queue is still flushed soon after the link is back.
+import random
+import socket
+import threading
+
+CONNECTED = "Connected"
+RECONNECTING = "Reconnecting"
+OFFLINE = "Offline"
+
+CONNECT_TIMEOUT = 5.0  # Seconds for one connect() attempt
+
+class Backoff:
+    # Retry policy, no I/O here : shared by the thread engine and the asyncio engine
+    def __init__(self, min_wait=0.5, max_wait=10.0, breaker_failures=10, breaker_cooldown=10.0):
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = min(breaker_cooldown, max_wait)
+        self.failures = 0  # Failed attempts since the last successful connect
+
+    def success(self):
+        self.failures = 0
+
+    def failure(self):
+        # Count a failed attempt, returns the seconds to wait before the next one
+        self.failures += 1
+        if self.is_open():
+            return self.breaker_cooldown  # Half-open : a single probe after the cooldown
+        ceiling = min(self.max_wait, self.min_wait * 2 ** (self.failures - 1))
+        return random.uniform(self.min_wait, max(self.min_wait, ceiling))  # Jitter : ports don't retry in lockstep
+
+    def is_open(self):
+        return self.failures >= self.breaker_failures
+
+    def state(self):
+        return OFFLINE if self.is_open() else RECONNECTING
+
+# Backoff from read_settings()
+def create_backoff(settings):
+    return Backoff(settings['Reconnect_Min'], settings['Reconnect_Max'], settings['Breaker_Failures'], settings['Breaker_Cooldown'])
+
+class ConnectionManager:
+    def __init__(self, address, port, backoff, on_change=None, on_connected=None):
+        self.address = address
+        self.port = int(port)
+        self.backoff = backoff
+        self.on_change = on_change        # on_change(old state, new state, seconds to next attempt or None)
+        self.on_connected = on_connected  # Wake the worker up, the queued files can go now
+        self.state = None                 # None until the first attempt is done
+        self.socket_conn = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()   # Set when the link broke or on close()
+        self.closed = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True, name=f"connect_{self.port}")
+        self.thread.start()
+
+    def current(self):
+        # Socket of the live link, None while (re)connecting
+        return self.socket_conn
+
+    def failed(self, socket_conn):
+        # Called by the worker when sending on socket_conn failed : reconnect right away
+        with self.lock:
+            if socket_conn is not self.socket_conn:
+                return  # Already replaced
+            self.socket_conn = None
+        try:
+            socket_conn.close()
+        except OSError:
+            pass
+        self._set_state(RECONNECTING, None)
+        self.wakeup.set()
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        with self.lock:
+            socket_conn, self.socket_conn = self.socket_conn, None
+        if socket_conn is not None:
+            try:
+                socket_conn.shutdown(socket.SHUT_RDWR)  # Wakes up a worker blocked in recv() on it
+            except OSError:
+                pass
+            socket_conn.close()
+
+    def _set_state(self, state, wait):
+        old, self.state = self.state, state
+        if old != state and self.on_change is not None:
+            self.on_change(old, state, wait)
+
+    def _run(self):
+        while not self.closed:
+            if self.socket_conn is not None:
+                self.wakeup.wait()  # Link is up, nothing to do until failed() or close()
+                self.wakeup.clear()
+                continue
+
+            try:
+                socket_conn = socket.create_connection((self.address, self.port), timeout=CONNECT_TIMEOUT)
+                socket_conn.settimeout(None)
+            except OSError as e:
+                wait = self.backoff.failure()
+                print(f"Attempt {self.backoff.failures}: Error connecting to {self.address}:{self.port} - {e}, next attempt in {wait:.1f} s")
+                self._set_state(self.backoff.state(), wait)
+                self.wakeup.wait(wait)
+                self.wakeup.clear()
+                continue
+
+            if self.closed:
+                socket_conn.close()
+                break
+            self.backoff.success()
+            with self.lock:
+                self.socket_conn = socket_conn
+            self._set_state(CONNECTED, None)
+            if self.on_connected is not None:
+                self.on_connected()
@@ -0,0 +1,151 @@
+# Structured upload log : one JSON line per acknowledged board, written by a background
+# thread once the file is archived (so every stage has its time) :
+#   {"machine": "SPI 1", "serial": "SN123", "event_id": "42", "file": ".../SN123_..._OK.csv",
+#    "written": ..., "detected": ..., "parsed": ..., "sent": ..., "acked": ..., "archived": ...,
+#    "response": "..."}      times are epoch seconds, "written" is the file mtime
+# Files : <Event_Dir>/events_20240131.jsonl (one per day) + <Event_Dir>/index.db, a SQLite
+# serial -> (file, byte offset) index, so "was board X uploaded ?" is one index lookup and
+# one seek, whatever the number of months kept.
+#   > python Middleware_Events.py SERIAL [--json]
+# The stage times are taken with time.monotonic() along the pipeline (trace dict carried in
+# the message context) and converted to wall clock here.
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+FLUSH_INTERVAL = 1.0  # Max seconds a record waits in memory
+FLUSH_RECORDS = 500   # ... or max buffered records
+
+STAGES = ('detected', 'parsed', 'sent', 'acked', 'archived')
+
+# Stage times of one message, filled in along the pipeline (monotonic seconds)
+def new_trace(detected, written=None):
+    return {'written': written, 'detected': detected, 'parsed': None, 'sent': None, 'acked': None, 'archived': None}
+
+class EventLog:
+    def __init__(self, event_dir):
+        os.makedirs(event_dir, exist_ok=True)
+        self.event_dir = event_dir
+        self.queue = queue.SimpleQueue()
+        self.file = None
+        self.file_name = None
+        self.thread = threading.Thread(target=self._run, daemon=True, name="event_log")
+        self.thread.start()
+
+    def record(self, machine, serial, event_id, file_path, trace, response):
+        # Hot path : monotonic stage times -> epoch seconds, the rest is done by the writer thread
+        offset = time.time() - time.monotonic()
+        record = {'machine': machine, 'serial': serial, 'event_id': str(event_id), 'file': file_path, 'written': trace.get('written')}
+        for stage in STAGES:
+            value = trace.get(stage)
+            record[stage] = None if value is None else round(value + offset, 3)
+        record['response'] = response
+        self.queue.put(record)
+
+    def close(self, timeout=5.0):
+        self.queue.put(None)
+        self.thread.join(timeout=timeout)
+
+    ### Writer thread ###
+
+    def _write(self, records, index):
+        # Append to the file of the day, then index the offsets (the lines are on disk first)
+        rows = []
+        for record in records:
+            file_name = datetime.fromtimestamp(record['acked'] or time.time()).strftime('events_%Y%m%d.jsonl')
+            if file_name != self.file_name:
+                if self.file is not None:
+                    self.file.close()
+                self.file = open(os.path.join(self.event_dir, file_name), 'ab')
+                self.file_name = file_name
+            offset = self.file.tell()
+            self.file.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+            rows.append((record['serial'], file_name, offset))
+        self.file.flush()
+        index.executemany("INSERT INTO event_index (serial, file, offset) VALUES (?, ?, ?)", rows)
+        index.commit()
+        records.clear()
+
+    def _run(self):
+        index = open_index(self.event_dir)
+        records = []
+        deadline = None
+        while True:
+            try:
+                item = self.queue.get(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = ()  # Flush time reached
+
+            if item:
+                records.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + FLUSH_INTERVAL
+            if records and (not item or len(records) >= FLUSH_RECORDS):
+                try:
+                    self._write(records, index)
+                except (OSError, sqlite3.Error) as e:
+                    print(f"Cannot write the event log in {self.event_dir} ({e})")
+                    records.clear()
+                deadline = None
+
+            if item is None:
+                if self.file is not None:
+                    self.file.close()
+                index.close()
+                return
+
+def open_index(event_dir):
+    index = sqlite3.connect(os.path.join(event_dir, 'index.db'))
+    index.execute("PRAGMA journal_mode=WAL")
+    index.execute("CREATE TABLE IF NOT EXISTS event_index (serial TEXT, file TEXT NOT NULL, offset INTEGER NOT NULL)")
+    index.execute("CREATE INDEX IF NOT EXISTS event_serial ON event_index(serial)")
+    index.commit()
+    return index
+
+# Records of a serial, oldest first
+def lookup(event_dir, serial):
+    index = open_index(event_dir)
+    try:
+        rows = index.execute("SELECT file, offset FROM event_index WHERE serial=? ORDER BY rowid", (serial,)).fetchall()
+    finally:
+        index.close()
+    records = []
+    for file_name, offset in rows:
+        with open(os.path.join(event_dir, file_name), 'rb') as f:
+            f.seek(offset)
+            records.append(json.loads(f.readline()))
+    return records
+
+# EventLog from read_settings(), None when [Source] Event_Log = 0
+def open_event_log(settings):
+    if not settings.get('Event_Log'):
+        return None
+    return EventLog(settings['Event_Dir'])
+
+if __name__ == "__main__":
+    from Middleware_Helper import read_settings
+
+    parser = argparse.ArgumentParser(description="Was this board uploaded ? Looks a serial up in the structured upload log")
+    parser.add_argument('serial')
+    parser.add_argument('--json', action='store_true', help="Print the raw records")
+    parser.add_argument('--ini', default='1_SPI_Middleware_setting.ini')
+    args = parser.parse_args()
+
+    settings = read_settings(args.ini)
+    start = time.perf_counter()
+    found = lookup(settings['Event_Dir'], args.serial)
+    elapsed = (time.perf_counter() - start) * 1000
+    for record in found:
+        if args.json:
+            print(json.dumps(record))
+            continue
+        stamp = lambda stage: '-' if record[stage] is None else datetime.fromtimestamp(record[stage]).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        print(f"{record['machine']}  event {record['event_id']}  acked {stamp('acked')}  archived {stamp('archived')}")
+        print(f"    file {record['file']}")
+        print(f"    detected {stamp('detected')}  parsed {stamp('parsed')}  sent {stamp('sent')}  response {record['response']!r}")
+    print(f"{args.serial} : {len(found)} upload(s) found in {elapsed:.1f} ms")
@@ -3,15 +3,74 @@
 import time
 import os
 import re
+import heapq
+import threading
+import configparser
 import socket
 import xml.etree.ElementTree as ET
 from datetime import datetime
-import tkinter as tk
-from tkinter import simpledialog, messagebox
 import subprocess
+from Middleware_Xml import XmlPlan, compile_xml_mappings
+from Middleware_Log import log_writer
+# tkinter is imported inside the GUI helpers only, so the headless service starts without it
 
 MAX_LINES = 300  # Max number of lines to display 
 
+########### 1. Settings ##########
+
+# Read 1_SPI_Middleware_setting.ini into a dict (used by the async engine, the GUI keeps its globals)
+def read_settings(file_path='1_SPI_Middleware_setting.ini'):
+    config = configparser.ConfigParser()
+    config.read(file_path)
+    split = lambda value: [v.strip() for v in value.split(',')]
+    xml_mappings = dict(config.items('PALMI_XML_Mapping'))
+
+    return {
+        'Source_Dir': config.get('Source', 'Source_Dir'),
+        'Source_Sub_Dir': split(config.get('Source', 'Source_Sub_Dir')),
+        'File_Types': split(config.get('Source', 'File_Types')),
+        'Target_Dir': config.get('Source', 'Target_Dir'),
+        'Log_Dir': config.get('Source', 'Log_Dir').strip(),
+        'Move_File': int(config.get('Source', 'Move_File', fallback=0)),  # 0 delete, 1 move to Target_Dir, 2 bundle into Zip_Dir
+        'Zip_Dir': config.get('Source', 'Zip_Dir', fallback=os.path.join(config.get('Source', 'Target_Dir').strip(), 'Zip')).strip(),
+        'Zip_Rotate': config.get('Source', 'Zip_Rotate', fallback='hour').strip().lower(),
+        'Zip_Max_MB': int(config.get('Source', 'Zip_Max_MB', fallback=256)),
+        'Zip_Seal_Minutes': float(config.get('Source', 'Zip_Seal_Minutes', fallback=0)),  # 0 = bundle sealed at the end of its hour/day
+        'Log_Activity': int(config.get('Source', 'Log_Activity', fallback=1)),
+        'Log_Rotate': config.get('Source', 'Log_Rotate', fallback='day').strip().lower(),
+        'Log_Max_MB': int(config.get('Source', 'Log_Max_MB', fallback=10)),
+        'Log_Backups': int(config.get('Source', 'Log_Backups', fallback=30)),
+        'Log_Compress': int(config.get('Source', 'Log_Compress', fallback=1)),
+        'Event_Log': int(config.get('Source', 'Event_Log', fallback=0)),
+        'Event_Dir': config.get('Source', 'Event_Dir', fallback=os.path.join(config.get('Source', 'Log_Dir').strip(), 'events')).strip(),
+        'Polling_Interval': int(config.get('Source', 'Polling_Interval', fallback=5)),
+        'Watch_Mode': config.get('Source', 'Watch_Mode', fallback='auto'),
+        'Engine': config.get('Source', 'Engine', fallback='thread').strip().lower(),
+        'File_Workers': int(config.get('Source', 'File_Workers', fallback=4)),
+        'Outbox': int(config.get('Source', 'Outbox', fallback=0)),
+        'Outbox_File': config.get('Source', 'Outbox_File', fallback=os.path.join(config.get('Source', 'Log_Dir').strip(), 'outbox.db')).strip(),
+        'Outbox_Keep_Days': int(config.get('Source', 'Outbox_Keep_Days', fallback=7)),
+        'State_Dir': config.get('Source', 'State_Dir', fallback=os.path.join(config.get('Source', 'Log_Dir').strip(), 'state')).strip(),
+        'XML_Mappings': xml_mappings,
+        'Parse_Workers': int(config.get('Source', 'Parse_Workers', fallback=0)),
+        'Prune_Empty_Dirs': int(config.get('Source', 'Prune_Empty_Dirs', fallback=0)),
+        'Stable_Time': int(config.get('Source', 'Stable_Time', fallback=0)) / 1000,  # ms in the ini
+        'XML_Plan': compile_xml_mappings(xml_mappings, config.get('Source', 'XML_Parser', fallback='tree').strip().lower()),  # Fails here on a bad mapping, not on every file
+        'CSV_Result_0': split(config.get('Pass_Condition', 'CSV_Result_0_If_FileEnd')),
+        'XML_Result_0': split(config.get('Pass_Condition', 'XML_Result_0_If_ResultCode')),
+        'Standby_Time': int(config.get('Machine_State_Time', 'Standby_Time', fallback=600)),
+        'Unknown_Time': int(config.get('Machine_State_Time', 'Unknown_Time', fallback=1800)),
+        'HSC_Address': config.get('HSC_Server', 'HSC_Address'),
+        'HSC_Ports': [int(p) for p in split(config.get('HSC_Server', 'HSC_Port'))],
+        'Machine_Names': split(config.get('HSC_Server', 'Machine_Names')),
+        'Machine_Types': split(config.get('HSC_Server', 'Machine_Types')),
+        'Send_Window': int(config.get('HSC_Server', 'Send_Window', fallback=1)),
+        'Reconnect_Min': float(config.get('HSC_Server', 'Reconnect_Min', fallback=0.5)),
+        'Reconnect_Max': float(config.get('HSC_Server', 'Reconnect_Max', fallback=10)),
+        'Breaker_Failures': int(config.get('HSC_Server', 'Breaker_Failures', fallback=10)),
+        'Breaker_Cooldown': float(config.get('HSC_Server', 'Breaker_Cooldown', fallback=10)),  # Capped at Reconnect_Max
+    }
+
 ########### 2. Helper function  ########## 
 
 ### 2.1 Prepare data input, CSV ###
@@ -21,6 +80,170 @@ def get_csv_files_sorted_by_date(directory):
     files_with_dates = [(f, os.path.getmtime(os.path.join(directory, f))) for f in files]
     return sorted(files_with_dates, key=lambda x: x[1])
 
+# Persistent per-directory index, replaces get_csv_files_sorted_by_date in the worker loop.
+# Each file is stat'ed once when it first appears and kept in a heap ordered by mtime,
+# so a cycle only costs one directory listing plus the new files (not the whole backlog).
+class DirectoryIndex:
+    def __init__(self, directory, extension='.csv'):
+        self.directory = directory
+        self.extension = extension
+        self.heap = []     # (mtime, file name) waiting to be processed, oldest first
+        self.seen = set()  # File names already indexed (processed, pending or skipped)
+
+    def refresh(self):
+        # Index the files that appeared since the last call, return how many were new
+        current = set()
+        new_files = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                name = entry.name
+                if not name.endswith(self.extension):
+                    continue
+                current.add(name)
+                if name in self.seen:
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue  # Removed between listing and stat
+                heapq.heappush(self.heap, (mtime, name))
+                self.seen.add(name)
+                new_files += 1
+
+        self.seen &= current  # Forget files that were removed by someone else
+        return new_files
+
+    def drain(self, ready=None):
+        # Pop files oldest first. A popped file stays "seen" until discard() or requeue()
+        # ready(name) -> False keeps a file (still being written) in the index for the next cycle
+        # Files not taken when the caller stops early (generator closed) stay in the index
+        held = []
+        try:
+            while self.heap:
+                mtime, name = heapq.heappop(self.heap)
+                if name not in self.seen:
+                    continue
+                if ready is not None and not ready(name):
+                    held.append((mtime, name))
+                    continue
+                yield name, mtime
+        finally:
+            for item in held:
+                heapq.heappush(self.heap, item)
+
+    def requeue(self, files):
+        # Put back (name, mtime) pairs that could not be sent, they are retried next cycle
+        for name, mtime in files:
+            heapq.heappush(self.heap, (mtime, name))
+
+    def discard(self, name):
+        # File was moved/deleted : if it is still there next cycle it is indexed again
+        self.seen.discard(name)
+
+    def __len__(self):
+        return len(self.heap)
+
+# Readiness stage between the scan and the parser : a result file is admitted only once
+# it is completely written, i.e. the watcher saw it closed after writing (inotify
+# IN_CLOSE_WRITE / IN_MOVED_TO) or its (size, mtime) did not change for stable_time seconds.
+# A file the watcher saw created waits for its close event (a writer may pause longer than
+# stable_time), up to WRITING_TIMEOUT in case the event was lost.
+# Files that failed to parse are remembered by (path, size, mtime) and skipped until they change.
+# Their stat is checked at most once per recheck_interval (the polling interval), or as soon as
+# the watcher reports them written.
+class ReadinessGate:
+    WRITING_TIMEOUT = 60.0
+
+    def __init__(self, stable_time=0.5, recheck_interval=3.0):
+        self.stable_time = stable_time
+        self.recheck_interval = recheck_interval
+        self.lock = threading.Lock()  # closed() comes from the watcher, the checks from the scan
+        self.writing = set()          # Reported created by the watcher, not closed yet
+        self.closed_files = set()     # Reported closed by the watcher, not admitted yet
+        self.pending = {}             # path -> ((size, mtime_ns), time.monotonic() it was first seen like this)
+        self.failed = {}              # path -> (size, mtime_ns, time.monotonic() of the last check) of a version that did not parse
+
+    def created(self, paths):
+        with self.lock:
+            self.writing.update(paths)
+
+    def closed(self, paths):
+        with self.lock:
+            self.writing.difference_update(paths)
+            self.closed_files.update(paths)
+
+    # Feed the watcher's file events (call created before closed, a file may be both)
+    def watch_events(self, watcher):
+        self.created(watcher.take_created())
+        self.closed(watcher.take_closed())
+
+    def is_ready(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.forget(path)
+            return False
+        signature = (stat.st_size, stat.st_mtime_ns)
+        now = time.monotonic()
+
+        with self.lock:
+            failed = self.failed.get(path)
+            if failed is not None and failed[:2] == signature:
+                self.failed[path] = signature + (now,)
+                return False  # Known broken and unchanged, don't parse it again
+            seen = self.pending.get(path)
+            stable_time = self.WRITING_TIMEOUT if path in self.writing else self.stable_time
+            if (self.stable_time <= 0 or path in self.closed_files
+                    or time.time() - stat.st_mtime >= stable_time  # Not written for stable_time already
+                    or (seen is not None and seen[0] == signature and now - seen[1] >= stable_time)):
+                self.closed_files.discard(path)
+                self.writing.discard(path)
+                self.pending.pop(path, None)
+                return True
+            # Recent mtime (or the share's clock is ahead) : wait until size/mtime stayed the same long enough
+            if seen is None or seen[0] != signature:
+                self.pending[path] = (signature, now)
+            return False
+
+    def ready(self, paths):
+        # Paths that can be parsed now, in the same order; entries of files that are gone are dropped.
+        # Known broken files checked less than recheck_interval ago cost no stat
+        paths = list(paths)
+        now = time.monotonic()
+        with self.lock:
+            present = set(paths)
+            for table in (self.pending, self.failed):
+                for path in [path for path in table if path not in present]:
+                    del table[path]
+            self.closed_files &= present
+            self.writing &= present
+            paths = [path for path in paths if path not in self.failed or path in self.closed_files
+                     or now - self.failed[path][2] >= self.recheck_interval]
+        return [path for path in paths if self.is_ready(path)]
+
+    def failed_paths(self):
+        with self.lock:
+            return set(self.failed)
+
+    def parse_failed(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self.lock:
+            self.failed[path] = (stat.st_size, stat.st_mtime_ns, time.monotonic())
+
+    def forget(self, path):
+        with self.lock:
+            self.writing.discard(path)
+            self.closed_files.discard(path)
+            self.pending.pop(path, None)
+            self.failed.pop(path, None)
+
+    def wait_time(self, polling_interval):
+        # Come back sooner than the polling interval while a file is waiting to be stable
+        return min(polling_interval, self.stable_time) if self.pending else polling_interval
+
 # Parse filename into components (Serial, DATETIME, Result)
 def parse_filename(filename):
     parts = filename.split('_')
@@ -39,8 +262,102 @@ def find_xml_files(root_dir):
                 xml_files.append(os.path.join(root, file))
     return xml_files # Full directory structure and name
 
+# Cached replacement for find_xml_files in the worker loop. Each directory is stat'ed every
+# scan but only re-listed when its mtime changed (a file or folder was added, removed or
+# renamed in it), so a scan costs one stat per folder plus the listing of the changed ones.
+# The mtime of every file comes from its listing (self.mtimes), not from a stat per file
+# per scan; when a folder is listed again the files already known (same inode) are not
+# stat'ed again, except the restat ones (files that failed to parse : a rewrite in place
+# keeps the inode). On Windows scandir gives the stat for free anyway.
+# With prune_empty, date/lot folders that stayed empty for prune_age seconds are removed.
+class TreeScanner:
+    RACY_WINDOW = 2.0  # A folder changed less than this ago may change again within the same mtime tick
+
+    def __init__(self, root_dir, extension='.xml', prune_empty=False, prune_age=60):
+        self.root_dir = root_dir
+        self.extension = extension.lower()
+        self.prune_empty = prune_empty
+        self.prune_age = prune_age
+        self.cache = {}   # directory -> (mtime_ns, {file path: (inode, mtime_ns)}, [sub directories])
+        self.mtimes = {}  # file path -> st_mtime_ns when its folder was last listed, for the last scan
+        self.listed = 0   # Folders re-listed by the last scan, the others came from the cache
+        self.pruned = 0   # Empty folders removed so far
+
+    def _list(self, directory, known, restat):
+        # known : the files of the previous listing, their mtime is kept while the inode is the same
+        # (not for the paths in restat)
+        files, subdirs = {}, []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(self.extension):
+                    cached = known.get(entry.path)
+                    if os.name != 'nt' and cached is not None and cached[0] == entry.inode() and entry.path not in restat:
+                        files[entry.path] = cached
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue  # Removed between listing and stat
+                    files[entry.path] = (stat.st_ino, stat.st_mtime_ns)
+        return files, subdirs
+
+    def scan(self, restat=()):
+        # Same result as find_xml_files(root_dir) (in another order).
+        # restat : paths whose mtime is read again when their folder is listed
+        found = []
+        mtimes = {}
+        visited = set()
+        now = time.time()
+        stack = [self.root_dir]
+        self.listed = 0
+
+        while stack:
+            directory = stack.pop()
+            try:
+                stat = os.stat(directory)
+            except OSError:
+                continue  # Removed in the meantime
+
+            cached = self.cache.get(directory)
+            if cached is not None and cached[0] == stat.st_mtime_ns and now - stat.st_mtime > self.RACY_WINDOW:
+                _, files, subdirs = cached
+            else:
+                try:
+                    files, subdirs = self._list(directory, cached[1] if cached is not None else {}, restat)
+                except OSError:
+                    continue
+                self.cache[directory] = (stat.st_mtime_ns, files, subdirs)
+                self.listed += 1
+
+            if (self.prune_empty and not files and not subdirs and directory != self.root_dir
+                    and now - stat.st_mtime > self.prune_age):
+                try:
+                    os.rmdir(directory)  # Fails (and is kept) if something was just written into it
+                    del self.cache[directory]
+                    self.pruned += 1
+                    continue  # Its parent's mtime changed, the parent is re-listed next scan
+                except OSError:
+                    pass
+
+            visited.add(directory)
+            found.extend(files)
+            for path, (_, mtime_ns) in files.items():
+                mtimes[path] = mtime_ns
+            stack.extend(subdirs)
+
+        for directory in list(self.cache):
+            if directory not in visited:
+                del self.cache[directory]  # Gone, or below a folder that is gone
+        self.mtimes = mtimes
+        return found
+
 def extract_data_from_xml(file_path, xml_mappings):
     #Extracts data based on user-defined full XML paths in setting.ini.
+    # With a compiled XmlPlan (settings['XML_Plan']) all fields come from one walk of the tree
+    if isinstance(xml_mappings, XmlPlan):
+        return xml_mappings.extract(file_path)
     try:
         tree = ET.parse(file_path)
         root = tree.getroot()
@@ -74,6 +391,25 @@ def extract_data_from_xml(file_path, xml_mappings):
 def determine_serial_state(result, result_0_conditions):
     return 0 if result in result_0_conditions else 1
 
+# Machine state shown by the rectangles : returns (new status, color) from the last status
+# and the seconds since the last successful upload
+def machine_state(status, elapsed_time, standby_time, unknown_time):
+    if status == "Error":
+        return status, "red"
+    if status == "File_issue":
+        return status, "orange"
+    if status == "Reconnecting":  # Link down, files are still collected (Middleware_Connection)
+        return status, "pink"
+    if status == "Offline":       # Circuit breaker open, probed every Breaker_Cooldown
+        return status, "firebrick"
+    if elapsed_time > unknown_time:
+        return "Unknown", "grey"
+    if elapsed_time > standby_time and status == "OK":
+        return "Standby", "yellow"
+    if status == "OK":
+        return status, "green"
+    return status, "grey"
+
 ### 2.3 Send data output to many types of target ###
 
 # Persistent connection function with retry logic
@@ -94,6 +430,8 @@ def establish_tcp_connection(address, port, max_retries=2):
     return None, False
 
 # Send data over an already established TCP connection with reconnection logic
+# With a ResponseReader (Middleware_Sender) exactly one framed answer line is consumed,
+# otherwise whatever the first recv() returns is taken as the answer.
 def send_data_tcp_persistent(socket_conn, data):
     try:
         if socket_conn:
@@ -121,22 +459,49 @@ def send_data_tcp(address, port, data):
         return str(e), False
 
 # Log events to a file for debugging and auditing
+# Queued for the app_log.txt writer thread of log_dir (Middleware_Log), no file access here
 def log_event(log_dir, event):
-    # Create the directory if it does not exist
-    os.makedirs(log_dir, exist_ok=True)
-    
-    log_file = os.path.join(log_dir, "app_log.txt")
-    
-    with open(log_file, "a") as f:
-        f.write(f"{datetime.now()} - {event}\n")
+    log_writer(log_dir).write(event)
+
+# Console output for the headless engines (the GUI passes its own callbacks instead)
+def print_log(log_type, message1, message2=""):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message1}{message2}")
+
+def print_status(idx, name, status, color, elapsed_time):
+    pass  # Headless default : status is only kept in memory (see snapshot())
+
+# Latest state of every machine rectangle. Worker threads / the event loop only write here
+# (cheap, thread-safe), the Tk main thread takes the changes at its own frame rate, so a
+# burst of 1000 uploads becomes at most one config() per rectangle per frame.
+class StatusBoard:
+    def __init__(self, count):
+        self.lock = threading.Lock()
+        self.states = [None] * count  # (name, status, color, elapsed_time)
+        self.dirty = set()            # Machines changed since the last take_changes()
+
+    def update(self, idx, name, status, color, elapsed_time):
+        # Same signature as the engines' on_status callback
+        state = (name, status, color, elapsed_time)
+        with self.lock:
+            if self.states[idx] != state:
+                self.states[idx] = state
+                self.dirty.add(idx)
+
+    def take_changes(self):
+        with self.lock:
+            changes = [(idx, self.states[idx]) for idx in sorted(self.dirty)]
+            self.dirty.clear()
+        return changes
 
 def trim_message_display(text_area, max_lines):
+    import tkinter as tk
     lines = text_area.get("1.0", tk.END).splitlines()
     if len(lines) > max_lines:
         text_area.delete("1.0", f"{max_lines + 1}.0")
 
 def update_display(text_area, text):
-    
+    import tkinter as tk
+
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     message = f"[{timestamp}] {text}"
 
@@ -149,11 +514,17 @@ def update_display(text_area, text):
 
 def show_about():
     """Display About information."""
+    from tkinter import messagebox
     messagebox.showinfo("About", "SPI Middleware v 0.2\nDeveloped by Mr. Tortong T")
 
-def show_statistics():
-    """Display Statistics information."""
-    messagebox.showinfo("Statistics", "[Under Construction]")
+def show_statistics(engine=None):
+    """Display Statistics information : stage latencies and counters per machine (Middleware_Stats)."""
+    from tkinter import messagebox
+    from Middleware_Stats import format_statistics
+    if engine is None:
+        messagebox.showinfo("Statistics", "Not started")
+        return
+    messagebox.showinfo("Statistics", format_statistics(engine.snapshot()))
 
 def open_config():
     # """Open the configuration file using Notepad."""
@@ -165,6 +536,7 @@ def open_config():
     #     messagebox.showerror("Error", f"Configuration file not found:\n{config_file}")
 
     """Ask for a password before opening the config file in Notepad."""
+    from tkinter import simpledialog, messagebox
     password = simpledialog.askstring(" ", "Enter the password:", show="*")
     
     if password == "12345":
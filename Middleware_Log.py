@@ -0,0 +1,170 @@
+# Activity log (<Log_Dir>/app_log.txt) written by ONE background thread per Log_Dir.
+# log_event() only puts (time, line) on a queue : no makedirs / open / write / close per
+# uploaded file anymore. The writer keeps the file open and writes the lines in blocks,
+# every FLUSH_INTERVAL seconds or FLUSH_BYTES, whichever comes first.
+# Rotation ([Source] Log_Rotate = day | size) :
+#   day  : app_log.txt is renamed app_log_20240131.txt at midnight (and at Log_Max_MB),
+#   size : only at Log_Max_MB, app_log_20240131.txt, app_log_20240131_2.txt, ...
+# Rotated files are gzip'ed with Log_Compress = 1, only the Log_Backups newest are kept.
+import glob
+import gzip
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+
+FLUSH_INTERVAL = 1.0     # Max seconds a line waits in memory
+FLUSH_BYTES = 64 * 1024  # ... or max buffered bytes
+
+class LogWriter:
+    def __init__(self, log_dir, file_name="app_log.txt", max_bytes=10 * 1024 * 1024, rotate='day', backups=30, compress=True):
+        if rotate not in ('day', 'size'):
+            raise ValueError(f"Log_Rotate = {rotate} : use day or size")
+        self.log_dir = log_dir
+        self.path = os.path.join(log_dir, file_name)
+        self.base, self.ext = os.path.splitext(file_name)
+        self.max_bytes = max_bytes
+        self.rotate = rotate
+        self.backups = backups
+        self.compress = compress
+        self.queue = queue.SimpleQueue()
+        self.file = None
+        self.size = 0
+        self.day = None  # Day of the lines in the current file
+        self.thread = threading.Thread(target=self._run, daemon=True, name="log_writer")
+        self.thread.start()
+
+    def write(self, event):
+        # Hot path : never touches the disk
+        self.queue.put((datetime.now(), event))
+
+    def close(self, timeout=5.0):
+        # Write what is queued, then stop the thread
+        self.queue.put(None)
+        self.thread.join(timeout=timeout)
+
+    ### Writer thread ###
+
+    def _open(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.file = open(self.path, 'a', encoding='utf-8', errors='replace')
+        self.size = self.file.tell()
+        if self.size:  # Lines left by the last run : their day is the day the file was last written
+            self.day = datetime.fromtimestamp(os.path.getmtime(self.path)).date()
+
+    def _rotated_name(self):
+        # app_log_20240131.txt, then _2, _3 ... after the highest part of that day (pruned parts are not reused)
+        day = (self.day or datetime.now().date()).strftime('%Y%m%d')
+        prefix = os.path.join(self.log_dir, f"{self.base}_{day}")
+        parts = [0]
+        for name in glob.glob(glob.escape(prefix) + '*'):
+            suffix = name[len(prefix):].split('.')[0]
+            if suffix == '':
+                parts.append(1)
+            elif suffix[1:].isdigit():
+                parts.append(int(suffix[1:]))
+        part = max(parts) + 1
+        return f"{prefix}{self.ext}" if part == 1 else f"{prefix}_{part}{self.ext}"
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+        rotated = self._rotated_name()
+        os.replace(self.path, rotated)
+        if self.compress:
+            with open(rotated, 'rb') as src, gzip.open(rotated + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.remove(rotated)
+
+        old_files = glob.glob(os.path.join(glob.escape(self.log_dir), f"{glob.escape(self.base)}_*{self.ext}*"))
+        old_files.sort(key=os.path.getmtime, reverse=True)
+        for old_file in old_files[self.backups:]:
+            os.remove(old_file)
+        self._open()
+        self.day = None
+
+    def _write(self, lines, check_size=True):
+        # One rotation decision per block, before writing it : a full file (Log_Max_MB) is rotated
+        # and the block starts the new one. check_size=False : the caller rotates right after
+        if not lines:
+            return
+        if check_size and self.size >= self.max_bytes:
+            self._rotate()
+        text = ''.join(lines)
+        self.file.write(text)
+        self.file.flush()
+        self.size += len(text)
+        lines.clear()
+
+    def _run(self):
+        lines = []
+        buffered = 0
+        deadline = None  # Flush time of the oldest buffered line
+        while True:
+            try:
+                item = self.queue.get(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = ()  # Flush time reached
+
+            try:
+                if self.file is None:
+                    self._open()
+                if item:
+                    stamp, event = item
+                    if self.rotate == 'day' and self.day is not None and stamp.date() != self.day:
+                        self._write(lines, check_size=False)  # The last lines of the day stay in its file
+                        buffered = 0
+                        deadline = None
+                        if self.size:
+                            self._rotate()
+                    self.day = stamp.date()
+                    lines.append(f"{stamp} - {event}\n")
+                    buffered += len(lines[-1])
+                    if deadline is None:
+                        deadline = time.monotonic() + FLUSH_INTERVAL
+                if not item or buffered >= FLUSH_BYTES:
+                    self._write(lines)
+                    buffered = 0
+                    deadline = None
+            except OSError as e:  # Disk full, Log_Dir gone ... : drop this block, try again with the next lines
+                print(f"Cannot write {self.path} ({e})")
+                lines.clear()
+                buffered = 0
+                deadline = None
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+
+            if item is None:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                return
+
+_writers = {}  # Log_Dir -> LogWriter, created by the first log_event() of each folder
+_writers_lock = threading.Lock()
+_options = {}  # LogWriter options from configure_logs()
+
+# Rotation settings from read_settings(), used by the writers created afterwards
+def configure_logs(settings):
+    _options.update(max_bytes=settings['Log_Max_MB'] * 1024 * 1024, rotate=settings['Log_Rotate'],
+                    backups=settings['Log_Backups'], compress=bool(settings['Log_Compress']))
+
+def log_writer(log_dir):
+    writer = _writers.get(log_dir)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(log_dir)
+            if writer is None:
+                writer = _writers[log_dir] = LogWriter(log_dir, **_options)
+    return writer
+
+# Flush and stop every writer (engine stop), the next log_event() starts a new one
+def close_logs():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
@@ -0,0 +1,178 @@
+# Durable outbox (write-ahead journal) for the uploads, stored in SQLite with WAL.
+# Every result file goes through   parsed -> sent -> acked -> archived
+# and the journal row is the single source of truth about its fate :
+#   - an ACK is committed BEFORE the file is moved/deleted, so a crash between the
+#     ACK and shutil.move never uploads the same board twice (restart just archives it),
+#   - a file that was parsed but not acknowledged keeps its uploadData line and
+#     event id, so after an HSC outage it is resent straight from the journal
+#     (no re-parsing of the XML, same event id as the first attempt).
+# Commits are grouped : "parsed"/"sent"/"archived" are written lazily (losing them only
+# means re-parsing a file that is still there), "acked" commits immediately. With WAL +
+# synchronous=NORMAL a commit is a WAL append, the fsync happens at checkpoints.
+import os
+import sqlite3
+import threading
+import time
+
+PARSED = 'parsed'
+SENT = 'sent'
+ACKED = 'acked'
+ARCHIVED = 'archived'
+
+class Outbox:
+    def __init__(self, db_path, commit_interval=0.5, commit_batch=200):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.commit_interval = commit_interval  # Max seconds a lazy change waits for its commit
+        self.commit_batch = commit_batch        # ... or max number of lazy changes
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level='DEFERRED')
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            machine TEXT NOT NULL,
+            path TEXT NOT NULL,
+            event_id TEXT,
+            data TEXT,
+            state TEXT NOT NULL,
+            response TEXT,
+            created REAL,
+            updated REAL)""")
+        self.conn.execute("DROP INDEX IF EXISTS outbox_path")  # Was only used by the per-file lookup
+        self.conn.execute("CREATE INDEX IF NOT EXISTS outbox_state ON outbox(machine, state, id)")
+        self.conn.commit()
+
+    ### Commit policy ###
+
+    def _changed(self, force=False):
+        # Called with the lock held after every write
+        self.uncommitted += 1
+        now = time.monotonic()
+        if force or self.uncommitted >= self.commit_batch or now - self.last_commit >= self.commit_interval:
+            self.conn.commit()
+            self.uncommitted = 0
+            self.last_commit = now
+
+    def flush(self):
+        with self.lock:
+            self.conn.commit()
+            self.uncommitted = 0
+            self.last_commit = time.monotonic()
+
+    ### File life cycle ###
+
+    def insert(self, machine, path, event_id, data):
+        # New row for a freshly parsed file (PendingRows knows it is not journaled yet), returns its id
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO outbox (machine, path, event_id, data, state, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (machine, path, str(event_id), data, PARSED, now, now))
+            self._changed()
+        return cursor.lastrowid
+
+    def mark(self, row_id, state, response=None):
+        with self.lock:
+            self.conn.execute("UPDATE outbox SET state=?, response=COALESCE(?, response), updated=? WHERE id=?",
+                              (state, response, time.time(), row_id))
+            self._changed(force=(state == ACKED))  # The ACK must be on disk before the file is moved
+
+    def sent(self, row_id):
+        self.mark(row_id, SENT)
+
+    def acked(self, row_id, response):
+        self.mark(row_id, ACKED, response)
+
+    def archived(self, row_id):
+        self.mark(row_id, ARCHIVED)
+
+    ### Restart / drain ###
+
+    def unarchived(self, machine, state=None):
+        # Rows still in flight for a machine, oldest first : [(row id, path, event_id, data, state)]
+        with self.lock:
+            if state is None:
+                query = "SELECT id, path, event_id, data, state FROM outbox WHERE machine=? AND state!=? ORDER BY id"
+                return self.conn.execute(query, (machine, ARCHIVED)).fetchall()
+            query = "SELECT id, path, event_id, data, state FROM outbox WHERE machine=? AND state=? ORDER BY id"
+            return self.conn.execute(query, (machine, state)).fetchall()
+
+    def recover(self, machine, archive):
+        # At start-up : finish the files that were acknowledged before a crash and drop rows whose
+        # file disappeared while not acknowledged. archive(path, data, on_done) hands a file to the
+        # archiver, on_done() marks its row archived. Returns how many files were handed over.
+        recovered = 0
+        for row_id, path, _, data, state in self.unarchived(machine):
+            if state == ACKED:
+                if os.path.exists(path):
+                    archive(path, data, lambda row_id=row_id: self.archived(row_id))
+                    recovered += 1
+                else:
+                    self.archived(row_id)
+            elif not os.path.exists(path):
+                self.archived(row_id)  # Removed by hand, nothing left to upload
+        self.flush()
+        return recovered
+
+    def prune(self, keep_days):
+        # Forget archived rows older than keep_days so the journal does not grow forever
+        with self.lock:
+            self.conn.execute("DELETE FROM outbox WHERE state=? AND updated<?", (ARCHIVED, time.time() - keep_days * 86400))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+# The rows of one machine that were parsed but not acknowledged yet (outage, NACK, restart),
+# loaded once after recover() and kept in memory by its worker. Each cycle they are sent
+# first, straight from the journal (no re-parse, same event id); the directory scan then
+# only looks for new arrivals and knows a journaled file without one query per file.
+class PendingRows:
+    def __init__(self, outbox, machine):
+        self.outbox = outbox
+        self.machine = machine
+        self.rows = {}  # path -> (row id, event_id, data), oldest first
+        for row_id, path, event_id, data, state in outbox.unarchived(machine):
+            if state in (PARSED, SENT):
+                self.rows[path] = (row_id, event_id, data)
+
+    def __contains__(self, path):
+        return path in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, path, event_id, data):
+        # Journal a freshly parsed file, returns its row id
+        row_id = self.outbox.insert(self.machine, path, event_id, data)
+        self.rows[path] = (row_id, str(event_id), data)
+        return row_id
+
+    def discard(self, path):
+        # Acknowledged : the archiver takes it from here
+        self.rows.pop(path, None)
+
+    def take(self):
+        # [(path, (row id, event_id, data))] to send now, oldest first. Files removed by hand are dropped.
+        rows = []
+        for path, row in list(self.rows.items()):
+            if os.path.exists(path):
+                rows.append((path, row))
+            else:
+                self.outbox.archived(row[0])  # Nothing left to upload
+                del self.rows[path]
+        return rows
+
+# Outbox from read_settings(), None when [Source] Outbox = 0
+def open_outbox(settings):
+    if not settings.get('Outbox'):
+        return None
+    outbox = Outbox(settings['Outbox_File'])
+    outbox.prune(settings['Outbox_Keep_Days'])
+    return outbox
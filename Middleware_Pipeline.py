@@ -0,0 +1,467 @@
+# Thread engine : one OS thread per Source_Sub_Dir entry, each with its own persistent
+# socket to its HSC port. This is the original SPI Middleware pipeline, moved out of
+# 1_SPI_Middleware.py so it runs the same with the Tk GUI or headless (Middleware_Service.py).
+# Machine status and log lines are reported through callbacks, nothing here imports Tk.
+# With [Source] Outbox = 1 every upload goes through the SQLite outbox (Middleware_Outbox.py).
+# Acknowledged files are moved/deleted by a background Archiver (Middleware_Archive.py).
+import os
+import time
+import threading
+from datetime import datetime
+
+from Middleware_Helper import DirectoryIndex, TreeScanner, ReadinessGate, parse_filename, determine_serial_state
+from Middleware_Helper import machine_state, log_event
+from Middleware_Archive import open_archiver, upload_serial
+from Middleware_Log import configure_logs, close_logs
+from Middleware_Events import open_event_log, new_trace
+from Middleware_Stats import MachineStats
+from Middleware_Helper import print_log, print_status
+from Middleware_Watcher import create_watcher
+from Middleware_Sender import PipelinedSender
+from Middleware_Outbox import open_outbox, PendingRows
+from Middleware_State import open_event_state
+from Middleware_Connection import ConnectionManager, CONNECTED, OFFLINE, create_backoff
+from Middleware_Xml import open_parse_pool, parse_records, sort_by_mtime
+
+class ThreadMiddleware:
+    def __init__(self, settings, on_status=print_status, on_log=print_log):
+        self.settings = settings
+        self.on_status = on_status  # on_status(idx, name, status, color, elapsed_time)
+        self.on_log = on_log        # on_log(log_type, message1, message2="")
+
+        self.machine_names = settings['Machine_Names']
+        self.move_file = settings['Move_File']
+        self.log_activity = settings['Log_Activity']
+        self.send_window = settings['Send_Window']
+        self.machine_updates = [datetime.now()] * len(self.machine_names)
+        self.machine_statuses = ["Unknown"] * len(self.machine_names)
+        self.stats = [MachineStats() for _ in self.machine_names]  # Stage latencies and counters per machine
+        self.event_states = []  # EventIdState per machine (next / last acked event id), opened by start()
+        self.outbox = None  # Opened by start()
+        self.parse_pool = None  # XML parse processes shared by the XML lines ([Source] Parse_Workers), opened by start()
+        self.archiver = None  # Background move/delete of the acknowledged files, started by start()
+        self.event_log = None  # Structured upload log ([Source] Event_Log), opened by start()
+        self.pending = {}  # idx -> PendingRows of the machine (outbox rows not acknowledged yet), set by its worker
+
+        self.stop_event = threading.Event()
+        self.stop_lock = threading.Lock()  # One teardown at a time, a second stop() waits for the first
+        self.threads = []   # Store running threads
+        self.watchers = []  # Directory watchers, one per thread (woken up on Stop)
+        self.connections = []  # ConnectionManager per thread (closed on Stop, a blocked recv() returns)
+
+    def log_message(self, log_type, message1, message2=""):
+        self.on_log(log_type, message1, message2)
+
+    # Status change from a worker : the rectangle restarts at "0 s"
+    def set_status(self, idx, status):
+        self.machine_statuses[idx] = status
+        _, color = machine_state(status, 0, self.settings['Standby_Time'], self.settings['Unknown_Time'])
+        self.on_status(idx, self.machine_names[idx], status, color, 0)
+
+    # Periodic refresh : OK turns into Standby / Unknown when nothing was uploaded for a while
+    def update_rectangles(self, idx):
+        elapsed_time = (datetime.now() - self.machine_updates[idx]).seconds
+        self.machine_statuses[idx], color = machine_state(self.machine_statuses[idx], elapsed_time, self.settings['Standby_Time'], self.settings['Unknown_Time'])
+        self.on_status(idx, self.machine_names[idx], self.machine_statuses[idx], color, elapsed_time)
+
+    # Journal a freshly parsed message in the outbox, returns its row id (None without outbox)
+    def journal(self, idx, file_path, event_id, data):
+        pending = self.pending.get(idx)
+        if pending is None:
+            return None
+        return pending.add(file_path, event_id, data)
+
+    # Already in the outbox and not acknowledged : sent by with_pending(), not parsed again
+    def journaled(self, idx, file_path):
+        pending = self.pending.get(idx)
+        return pending is not None and file_path in pending
+
+    # At start-up, after recover() : the rows of the machine still to be sent
+    def load_pending(self, idx):
+        if self.outbox is not None:
+            self.pending[idx] = PendingRows(self.outbox, self.machine_names[idx])
+
+    # The messages of a cycle : first what is journaled and not acknowledged yet (parsed before an
+    # outage, a NACK or a restart), straight from the outbox with the event id of the first attempt,
+    # then the new files of the scan. name_of(path) gives the file name used in the context.
+    def with_pending(self, idx, name_of, new_messages):
+        pending = self.pending.get(idx)
+        if pending is not None:
+            detected = time.monotonic()
+            for path, (row_id, event_id, data) in pending.take():
+                if self.stop_event.is_set():
+                    return
+                if self.archiver.is_pending(path):
+                    continue  # Acknowledged, still waiting to be moved
+                yield event_id, data, (name_of(path), None, row_id, new_trace(detected))
+        yield from new_messages
+
+    # Called by PipelinedSender once a message is on the wire
+    def on_sent(self, context):
+        context[3]['sent'] = time.monotonic()
+        if self.outbox is not None and context[2] is not None:
+            self.outbox.sent(context[2])
+
+    # ACK received : the outbox row is committed as acked BEFORE the file is handed to the archiver,
+    # it is marked archived (and logged in the upload log) once the file is really moved/deleted.
+    # The worker does not wait for it.
+    def acknowledged(self, idx, event_id, data, row_id, trace, latency, response, source_file, target_file, make_dirs=False):
+        trace['acked'] = trace['sent'] + latency
+        self.event_states[idx].acked(event_id)
+        self.stats[idx].acked()
+        outbox, event_log, stats, machine_name, serial = self.outbox, self.event_log, self.stats[idx], self.machine_names[idx], upload_serial(data)
+        if outbox is not None:
+            outbox.acked(row_id, response)
+            self.pending[idx].discard(source_file)
+
+        def on_done():
+            trace['archived'] = time.monotonic()
+            stats.archived(trace)
+            if outbox is not None:
+                outbox.archived(row_id)
+            if event_log is not None:
+                event_log.record(machine_name, serial, event_id, source_file, trace, response)
+
+        self.archiver.submit(source_file, target_file, make_dirs, on_done, serial)
+        self.machine_updates[idx] = datetime.now()
+        self.set_status(idx, "OK")
+
+    # Not acknowledged : the file stays in place and is sent again next cycle.
+    # An answer with an error return code (NACK, latency known) is reported, a lost link is handled by the caller
+    def refused(self, idx, file_name, response, latency):
+        self.stats[idx].count('failed')
+        if latency is not None:
+            self.log_message(0, f"{self.machine_names[idx]} : {file_name} refused by the HSC ({response})")
+            self.set_status(idx, "File_issue")
+
+    # At start-up : archive what was acknowledged before the last stop/crash, target(path) -> (archive path, make_dirs)
+    def recover(self, idx, target):
+        if self.outbox is None:
+            return
+        def archive(path, data, on_done):
+            target_file, make_dirs = target(path)
+            self.archiver.submit(path, target_file, make_dirs, on_done, upload_serial(data))
+        recovered = self.outbox.recover(self.machine_names[idx], archive)
+        if recovered:
+            self.log_message(1, f"{self.machine_names[idx]} : {recovered} file(s) acknowledged before the last stop archived")
+
+    # Background connection of one worker : status + log on every link change, wakes the worker up when the link is back
+    def connect(self, idx, hsc_address, hsc_port, source_dir, watcher):
+        def on_change(old, state, wait):
+            if state == CONNECTED:
+                self.log_message(1,f"Connected [{hsc_address}:{hsc_port}] <-- {source_dir}")
+                self.set_status(idx, "Unknown")  # Back to normal, OK again with the next ACK
+                return
+            if old is None:
+                self.log_message(0, f"Failed to establish connection to {hsc_address}:{hsc_port}, retrying in background")
+            elif old == CONNECTED:
+                self.log_message(0,f"DISconnected [{hsc_address}:{hsc_port}]")
+            elif state == OFFLINE:
+                self.log_message(0, f"{hsc_address}:{hsc_port} still down, next try in {wait:.0f} s")
+            self.set_status(idx, state)
+
+        conn = ConnectionManager(hsc_address, hsc_port, create_backoff(self.settings), on_change, watcher.wake)
+        conn.start()
+        self.connections.append(conn)
+        return conn
+
+    # Link down : keep ingesting, files are parsed into the outbox now and sent from it (with_pending)
+    # as soon as the link is back. Without outbox they just stay queued.
+    def ingest(self, messages):
+        if self.outbox is not None:
+            for _ in messages:
+                pass
+
+    # Turn the indexed CSV files into (event_id, data, context) messages,
+    # context = (file_name, mtime, outbox row, trace of the stage times)
+    def csv_messages(self, idx, sub_dir, files, result_0_conditions):
+        detected = time.monotonic()
+        for file_name, mtime in files:
+            if self.stop_event.is_set():
+                return  # Stop pulling files, the ones in flight still get their ACK
+            file_path = os.path.join(sub_dir, file_name)
+            if self.journaled(idx, file_path):
+                continue  # Parsed before an outage or a restart : sent from the outbox by with_pending()
+            trace = new_trace(detected, mtime)
+
+            # Parse the filename into components
+            serial, datetime_part, result = parse_filename(file_name)
+            if not serial or not datetime_part or not result:
+                self.log_message(0, f"Skipping invalid file name : {file_name}")
+                self.stats[idx].count('skipped')
+                continue
+
+            # Determine the serial state based on the result
+            serial_nr_state = determine_serial_state(result, result_0_conditions)
+
+            # Format data to send over TCP
+            # My Org : data = f"\x02uploadData;{event_id};-1;1;{serial};-1;{serial_nr_state};0;\x0D\x0A"
+            event_id = self.event_states[idx].take()  # Looping back to 1 after 9999, kept across restarts
+            data = f"\x02uploadData;{event_id};0;1;{serial};1;{serial_nr_state};0;\x0D\x0A"
+            trace['parsed'] = time.monotonic()
+            self.stats[idx].parsed(trace)
+            yield event_id, data, (file_name, mtime, self.journal(idx, file_path, event_id, data), trace)
+
+    # Parse the XML files into (event_id, data, context) messages, event_id comes from the file
+    # mtimes : path -> mtime_ns from the scan (TreeScanner.mtimes), no stat per file and per cycle
+    def xml_messages(self, idx, xml_files, mtimes, xml_plan, result_0_conditions, gate):
+        detected = time.monotonic()
+        new_files = []  # Not in the outbox yet, parsed below
+        for file_name in xml_files:
+            if self.archiver.is_pending(file_name) or self.journaled(idx, file_name):
+                continue  # Acknowledged and waiting to be moved, or sent from the outbox by with_pending()
+            new_files.append(file_name)
+
+        new_files = gate.ready(sort_by_mtime(new_files, mtimes))  # Completely written and not known as broken
+
+        # Parse the XML content into components
+        if self.parse_pool is not None:
+            records = self.parse_pool.parse(new_files)  # Parse stage in the process pool, same order
+        else:
+            records = parse_records(xml_plan, new_files)  # One by one in this thread
+
+        for file_name, mtime, event_id, serial, result in records:
+            if self.stop_event.is_set():
+                return  # Exit thread immediately (connection is closed by the worker)
+
+            if not serial or not event_id or not result or "N/A" in (event_id, serial, result):
+                self.log_message(0, f"Skipping invalid file name : {file_name}")
+                self.set_status(idx, "File_issue")
+                self.stats[idx].count('skipped')
+                gate.parse_failed(file_name)  # Not parsed again until the file changes
+                continue
+
+            serial_nr_state = determine_serial_state(result, result_0_conditions)
+            data = f"\x02uploadData;{event_id};0;1;{serial};1;{serial_nr_state};0;\x0D\x0A"
+            trace = new_trace(detected, mtime)
+            trace['parsed'] = time.monotonic()
+            self.stats[idx].parsed(trace)
+            yield event_id, data, (file_name, None, self.journal(idx, file_name, event_id, data), trace)
+
+    # Process XML files in a multi-level subdirectory, LOOP is here !
+    def process_subdir_xml(self, idx, root_dir, target_root_dir, log_dir, xml_plan, result_0_conditions, hsc_address, hsc_port, polling_interval, watcher):
+
+        # Persistent connection, kept up by its own thread
+        conn = self.connect(idx, hsc_address, hsc_port, root_dir, watcher)
+        self.recover(idx, lambda path: (os.path.join(target_root_dir, os.path.relpath(path, root_dir)), True))
+        self.load_pending(idx)
+        scanner = TreeScanner(root_dir, '.xml', self.settings['Prune_Empty_Dirs'])  # Only changed folders are listed each cycle
+        gate = ReadinessGate(self.settings['Stable_Time'], self.settings['Polling_Interval'])  # Half-written reports are left for the next cycle
+        sender = None
+
+        while not self.stop_event.is_set():
+
+            self.update_rectangles(idx)
+
+            gate.watch_events(watcher)
+            xml_files = scanner.scan(gate.failed_paths())  # Broken files fixed in place get their new mtime
+            messages = self.xml_messages(idx, xml_files, scanner.mtimes, xml_plan, result_0_conditions, gate)
+
+            socket_conn = conn.current()
+            if socket_conn is None:
+                self.ingest(messages)  # Files stay in place until the link is back
+            else:
+                if sender is None or sender.socket_conn is not socket_conn:
+                    sender = PipelinedSender(socket_conn, self.send_window)  # Send_Window = 1 : one message at a time
+
+                # Up to Send_Window messages in flight, each file is archived on its own ACK
+                for event_id, data, (file_name, _, row_id, trace), response, success, latency in sender.pipeline(self.with_pending(idx, lambda path: path, messages), self.on_sent):
+                    if success:
+                        self.log_message(2, f"{self.machine_names[idx]} : ", f"{data[1:-2]}")
+                        relative_path = os.path.relpath(file_name, root_dir)  # Get relative path
+                        self.acknowledged(idx, event_id, data, row_id, trace, latency, response, file_name, os.path.join(target_root_dir, relative_path), make_dirs=True)
+                    else:
+                        self.refused(idx, file_name, response, latency)
+
+                    # Log the event details
+                    if self.log_activity == 1:
+                        log_event(log_dir, f"File: {file_name}, Sent: {data}, Response: {response}, Connected: {not sender.broken}, ACK: {'-' if latency is None else round(latency * 1000, 1)} ms")
+
+                if sender.broken: # Files that failed stay in place (and in the outbox), sent again once reconnected
+                    conn.failed(socket_conn)
+
+            # Wait for a new file (inotify), the link coming back or the polling interval, whichever comes first
+            watcher.wait(gate.wait_time(polling_interval))
+
+        # Close connection when exiting while loop
+        watcher.close()
+        conn.close()
+        self.log_message(1,f"DISconnected [{hsc_address}:{hsc_port}]")
+
+    # Process CSV files in a single subdirectory, LOOP is here !
+    def process_subdir_csv(self, idx, sub_dir, target_sub_dir, log_dir, result_0_conditions, hsc_address, hsc_port, polling_interval, watcher):
+
+        # Persistent connection, kept up by its own thread
+        conn = self.connect(idx, hsc_address, hsc_port, sub_dir, watcher)
+        self.recover(idx, lambda path: (os.path.join(target_sub_dir, os.path.basename(path)), False))
+        self.load_pending(idx)
+
+        files_index = DirectoryIndex(sub_dir, '.csv')  # Only new files are stat'ed each cycle
+        gate = ReadinessGate(self.settings['Stable_Time'], self.settings['Polling_Interval'])  # Files still being written stay in the index
+        archiver = self.archiver  # Acknowledged files waiting to be moved stay in the index too
+        ready = lambda file_name: not archiver.is_pending(os.path.join(sub_dir, file_name)) and gate.is_ready(os.path.join(sub_dir, file_name))
+        sender = None
+
+        while not self.stop_event.is_set():
+
+            self.update_rectangles(idx)
+
+            gate.watch_events(watcher)
+            files_index.refresh()
+            failed_files = []  # Kept in the index and retried on the next cycle
+
+            socket_conn = conn.current()
+            if socket_conn is None:
+                self.ingest(self.csv_messages(idx, sub_dir, files_index.drain(ready), result_0_conditions))
+            else:
+                if sender is None or sender.socket_conn is not socket_conn:
+                    sender = PipelinedSender(socket_conn, self.send_window)  # Send_Window = 1 : one message at a time
+
+                # Up to Send_Window messages in flight, each file is archived on its own ACK
+                messages = self.with_pending(idx, os.path.basename, self.csv_messages(idx, sub_dir, files_index.drain(ready), result_0_conditions))
+                for event_id, data, (file_name, mtime, row_id, trace), response, success, latency in sender.pipeline(messages, self.on_sent):
+                    if success:
+                        self.log_message(2, f"{self.machine_names[idx]} : ", f"{data[1:-2]}")
+                        self.acknowledged(idx, event_id, data, row_id, trace, latency, response, os.path.join(sub_dir, file_name), os.path.join(target_sub_dir, file_name))
+                        files_index.discard(file_name)
+                    else:
+                        if mtime is not None:  # Back in the index; a row from the outbox (no mtime) is resent by with_pending()
+                            failed_files.append((file_name, mtime))
+                        self.refused(idx, file_name, response, latency)
+
+                    # Log the event details
+                    if self.log_activity == 1:
+                        log_event(log_dir, f"File: {file_name}, Sent: {data}, Response: {response}, Connected: {not sender.broken}, ACK: {'-' if latency is None else round(latency * 1000, 1)} ms")
+
+                if sender.broken: # Failed files are requeued below, sent again once reconnected
+                    conn.failed(socket_conn)
+
+            files_index.requeue(failed_files)
+
+            # Wait for a new file (inotify), the link coming back or the polling interval, whichever comes first
+            watcher.wait(gate.wait_time(polling_interval))
+
+        # Close connection when exiting while loop
+        watcher.close()
+        conn.close()
+        self.log_message(1,f"DISconnected [{hsc_address}:{hsc_port}]")
+
+    # Master controller : Process files across all subdirectories using multi-threading
+    def start(self):
+        settings = self.settings
+        source_dir = settings['Source_Dir']
+        target_dir = settings['Target_Dir']
+        hsc_ports = settings['HSC_Ports']
+        watch_mode = settings['Watch_Mode']
+
+        if any(thread.is_alive() for thread in self.threads):
+            self.log_message(0, "The previous run is still stopping, not started")
+            return
+        self.stop_event.clear()  # Reset stop event
+        configure_logs(settings)
+        if self.outbox is None:
+            self.outbox = open_outbox(settings)
+        if self.parse_pool is None:
+            self.parse_pool = open_parse_pool(settings)
+        if not self.event_states:
+            self.event_states = [open_event_state(settings, name) for name in self.machine_names]
+        if self.archiver is None:
+            self.archiver = open_archiver(settings)
+        if self.event_log is None:
+            self.event_log = open_event_log(settings)
+        self.threads = []  # Clear old threads
+        self.watchers = []
+        self.connections = []
+
+        for idx, sub_dir in enumerate(settings['Source_Sub_Dir']):
+
+            # Construct paths for the source and target subdirectories
+            sub_dir_path = os.path.join(source_dir, sub_dir)
+            target_sub_dir = os.path.join(target_dir, sub_dir)
+            os.makedirs(target_sub_dir, exist_ok=True)  # Ensure target directory exists
+
+            # Create a thread for processing each subdirectory
+            if settings['File_Types'][idx] == 'CSV':
+                t_target = self.process_subdir_csv
+                watcher = create_watcher([sub_dir_path], watch_mode, extensions=['.csv'])
+                t_args = (idx, sub_dir_path, target_sub_dir, settings['Log_Dir'], settings['CSV_Result_0'], settings['HSC_Address'], hsc_ports[idx], settings['Polling_Interval'], watcher)
+
+            elif settings['File_Types'][idx] == 'XML':
+                t_target = self.process_subdir_xml
+                watcher = create_watcher([sub_dir_path], watch_mode, recursive=True, extensions=['.xml'])
+                t_args = (idx, sub_dir_path, target_sub_dir, settings['Log_Dir'], settings['XML_Plan'], settings['XML_Result_0'], settings['HSC_Address'], hsc_ports[idx], settings['Polling_Interval'], watcher)
+
+            else:
+                self.log_message(0, f"Unknown file type {settings['File_Types'][idx]} for {sub_dir}")
+                continue
+
+            thread = threading.Thread(target=t_target, args=t_args, daemon=True, name=self.machine_names[idx])  # Mark thread as a daemon so it exits with the main program
+            thread.start()
+            self.threads.append(thread)
+            self.watchers.append(watcher)
+
+    # True once everything is closed. False when a line did not finish within timeout : the shared
+    # outbox / archiver / event states stay open for it, a later stop() finishes the teardown.
+    def stop(self, timeout=2):
+        with self.stop_lock:
+            return self._stop(timeout)
+
+    def _stop(self, timeout):
+        self.stop_event.set()  # Signal threads to stop
+        for watcher in self.watchers:
+            watcher.wake()  # Don't wait for the rest of the polling interval
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))  # The ACKs in flight may still come
+        for conn in self.connections:
+            conn.close()  # A worker still waiting for an ACK gets an error now, not after the ACK timeout
+        deadline = time.monotonic() + timeout
+        for thread in self.threads + [conn.thread for conn in self.connections if conn.thread is not None]:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        still_running = [thread.name for thread in self.threads if thread.is_alive()]
+        if still_running:
+            self.log_message(0, f"Still stopping : {', '.join(still_running)}")
+            return False
+        self.threads = []
+        self.watchers = []
+        self.connections = []
+        if self.archiver is not None:
+            self.archiver.stop()  # Before the outbox : the moves that can be done now are marked archived
+            self.archiver = None
+        if self.event_log is not None:
+            self.event_log.close()  # After the archiver : its last records are written
+            self.event_log = None
+        close_logs()  # Write the buffered app_log.txt lines
+        if self.outbox is not None:
+            self.outbox.close()
+            self.outbox = None
+        for state in self.event_states:
+            state.close()
+        self.event_states = []
+        self.pending = {}
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+            self.parse_pool = None
+        return True
+
+    def run(self):
+        # Headless : blocks until stop() is called from another thread or Ctrl+C
+        self.start()
+        try:
+            while not self.stop_event.wait(1.0):
+                for idx in range(len(self.machine_names)):
+                    self.update_rectangles(idx)
+        except KeyboardInterrupt:
+            pass
+        # Tear down before returning : when stop() was called from another thread (signal handler of
+        # the service), this waits until it is done, so the process never exits half way through it
+        while not self.stop():
+            pass  # A line is still finishing, the outbox / archiver are closed once it is out
+
+    def snapshot(self):
+        # Plain dict view of the machine states, e.g. for a status endpoint
+        return [{'name': name, 'status': self.machine_statuses[idx], 'port': self.settings['HSC_Ports'][idx],
+                 'elapsed': (datetime.now() - self.machine_updates[idx]).seconds,
+                 'last_event_id': self.event_states[idx].last_acked if self.event_states else None,
+                 'stats': self.stats[idx].snapshot()}
+                for idx, name in enumerate(self.machine_names)]
@@ -0,0 +1,148 @@
+# Framing and pipelined sending for the HSC protocol.
+# Every HSC answer is one line ending with \r\n or \n, but TCP may glue several
+# answers together or split one across packets, so responses are read through a
+# buffered line reader instead of treating one recv() as one answer.
+# On top of it, up to Send_Window messages can be kept in flight on the persistent
+# connection and every ACK is matched back to the message it acknowledges.
+import time
+from collections import deque, namedtuple
+
+########### 1. Response framing ##########
+
+# One response line : text without STX/CR/LF, event id it acknowledges (None if the
+# answer does not carry one), ok flag and time.monotonic() when the line was complete
+HscMessage = namedtuple('HscMessage', ['text', 'event_id', 'ok', 'received'])
+
+MAX_LINE_SIZE = 64 * 1024  # A longer "line" means the peer is not speaking the HSC protocol
+
+# Parse an answer into (event_id, ok).
+# HSC style  : "uploadData;<event_id>;<return code>;..." with return code 0 = OK
+# Fake_Server: "001 ACK: Received uploadData" (no event id)
+def parse_ack(text):
+    fields = text.split(';')
+    if len(fields) >= 3:
+        return fields[1], fields[2].strip() == '0'
+    if len(fields) == 2:
+        return fields[1] or None, True
+    return None, 'ACK' in text.upper() or 'OK' in text.upper()
+
+class ResponseReader:
+    def __init__(self, socket_conn=None):
+        self.socket_conn = socket_conn
+        self._buffer = b""
+        self._messages = deque()  # Complete messages not handed out yet
+
+    def feed(self, chunk):
+        # Add raw bytes from the stream, return the list of messages completed by this chunk
+        self._buffer += chunk
+        received = time.monotonic()
+        completed = []
+        while True:
+            end = self._buffer.find(b"\n")
+            if end < 0:
+                break
+            line = self._buffer[:end].decode('utf-8', errors='replace').strip("\x02\r ")
+            self._buffer = self._buffer[end + 1:]
+            if line:
+                event_id, ok = parse_ack(line)
+                completed.append(HscMessage(line, event_id, ok, received))
+
+        if len(self._buffer) > MAX_LINE_SIZE:
+            raise ConnectionError("Response line too long, not an HSC answer")
+        return completed
+
+    def read_message(self):
+        # Block until one complete message is available (the socket timeout still applies)
+        while not self._messages:
+            chunk = self.socket_conn.recv(4096)
+            if not chunk:
+                raise ConnectionError("Connection closed by server")
+            self._messages.extend(self.feed(chunk))
+        return self._messages.popleft()
+
+########### 2. Pipelined sending ##########
+
+# Find which in-flight message an ACK belongs to.
+# A real HSC answer echoes the event id, the Fake_Server only answers "001 ACK: ..." :
+# in that case TCP ordering means it is the oldest one.
+# None when the answer echoes an event id that is not in flight (late or foreign answer) :
+# it must not acknowledge another message.
+def match_ack(message, in_flight):
+    if message.event_id is None:
+        return 0
+    for pos, entry in enumerate(in_flight):
+        if str(entry[0]) == message.event_id:
+            return pos
+    return None
+
+class PipelinedSender:
+    def __init__(self, socket_conn, window=8, timeout=10.0):
+        self.socket_conn = socket_conn
+        self.window = max(1, int(window))
+        self.timeout = timeout     # Max wait for the next ACK before the link is declared dead
+        self.broken = socket_conn is None
+        self.reader = ResponseReader(socket_conn)
+
+    def _fail_all(self, in_flight, reason):
+        self.broken = True
+        failed = [(event_id, data, context, reason, False, None) for event_id, data, context, _ in in_flight]
+        in_flight.clear()
+        return failed
+
+    def _collect(self, in_flight):
+        # Wait for one ACK and return the finished message(s); on error every in-flight message fails
+        try:
+            message = self.reader.read_message()
+        except (OSError, ConnectionError) as e:
+            return self._fail_all(in_flight, str(e))
+
+        pos = match_ack(message, in_flight)
+        if pos is None:
+            print(f"Answer for event id {message.event_id} which is not in flight, discarded : {message.text}")
+            return []
+        event_id, data, context, sent = in_flight[pos]
+        del in_flight[pos]
+        # success = the return code of the answer : a refused message (NACK) is not archived
+        return [(event_id, data, context, message.text, message.ok, message.received - sent)]
+
+    def pipeline(self, messages, on_sent=None):
+        # messages : iterable of (event_id, data, context), on_sent(context) is called once a message is written
+        # Yields (event_id, data, context, response, success, latency) as soon as each ACK is matched,
+        # latency is the send -> ACK time in seconds (None when nothing came back, i.e. the link failed;
+        # success False with a latency is a NACK : the HSC answered with an error return code)
+        in_flight = deque()  # (event_id, data, context, send time), oldest first
+
+        if self.socket_conn:
+            self.socket_conn.settimeout(self.timeout)
+
+        # Once the link is broken nothing more is pulled from messages : the files behind are not
+        # parsed, given an event id or journaled for nothing, they are picked up again next cycle
+        messages = iter(messages)
+        while not self.broken:
+            try:
+                event_id, data, context = next(messages)
+            except StopIteration:
+                break
+
+            while len(in_flight) >= self.window and not self.broken:
+                yield from self._collect(in_flight)
+
+            if self.broken:
+                # Lost while waiting for the window : this one is already taken, it fails without being sent
+                yield event_id, data, context, "No active connection", False, None
+                break
+
+            try:
+                self.socket_conn.sendall(data.encode('utf-8'))
+                in_flight.append((event_id, data, context, time.monotonic()))
+                if on_sent is not None:
+                    on_sent(context)
+            except OSError as e:
+                print(f"Connection lost: {e}")
+                yield from self._fail_all(in_flight, str(e))  # Whatever was still in flight fails too
+                yield event_id, data, context, str(e), False, None
+
+        while in_flight:
+            yield from self._collect(in_flight)
+        if hasattr(messages, 'close'):
+            messages.close()  # Generators give back what they still hold (see DirectoryIndex.drain)
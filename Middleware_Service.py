@@ -0,0 +1,115 @@
+# Headless service mode for the SPI Middleware : same CSV/XML pipelines as the GUI,
+# no Tkinter at all, so it can run as a Linux service (systemd) or a Windows task.
+# Machine status is served as JSON on a small local HTTP endpoint :
+#
+#   python Middleware_Service.py [--config 1_SPI_Middleware_setting.ini] [--engine thread|async] [--status-port 8765]
+#   python 1_SPI_Middleware.py --headless ...    (same thing)
+#
+#   GET /status  -> {"engine": ..., "uptime": ..., "machines": [{"name", "status", "port", "elapsed", "stats"}, ...]}
+#                   "stats" : counters, ACKs per minute and latency_ms (p50/p90/p99/max) per stage, see Middleware_Stats.py
+#   GET /health  -> "OK"
+import argparse
+import configparser
+import json
+import signal
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+DEFAULT_CONFIG = '1_SPI_Middleware_setting.ini'
+
+class StatusHandler(BaseHTTPRequestHandler):
+    service = None  # Set by start_status_server()
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ('', '/status'):
+            body = json.dumps(self.service.status()).encode('utf-8')
+            content_type = 'application/json'
+        elif self.path.rstrip('/') == '/health':
+            body = b'OK'
+            content_type = 'text/plain'
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep the console for the middleware messages
+
+class MiddlewareService:
+    def __init__(self, settings, engine_name):
+        self.settings = settings
+        self.engine_name = engine_name
+        self.started = datetime.now()
+        self.http_server = None
+
+        # Import only the engine we need, the async one pulls in asyncio
+        if engine_name == 'async':
+            from Middleware_Async import AsyncMiddleware
+            self.engine = AsyncMiddleware(settings)
+        else:
+            from Middleware_Pipeline import ThreadMiddleware
+            self.engine = ThreadMiddleware(settings)
+
+    def status(self):
+        return {
+            'engine': self.engine_name,
+            'started': self.started.strftime('%Y-%m-%d %H:%M:%S'),
+            'uptime': (datetime.now() - self.started).seconds,
+            'machines': self.engine.snapshot(),
+        }
+
+    def start_status_server(self, address, port):
+        StatusHandler.service = self
+        self.http_server = HTTPServer((address, port), StatusHandler)
+        thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+        thread.start()
+        print(f"Status endpoint on http://{address}:{port}/status")
+
+    def run(self):
+        self.engine.run()  # Blocks until stop()
+        if self.http_server is not None:
+            self.http_server.shutdown()
+
+    def stop(self, *_):
+        threading.Thread(target=self.engine.stop, daemon=True).start()  # Never block inside a signal handler
+
+def main(argv=None):
+    t_start = time.monotonic()
+    parser = argparse.ArgumentParser(description="SPI Middleware, headless service mode")
+    parser.add_argument('--config', default=DEFAULT_CONFIG, help="Setting file (default: %(default)s)")
+    parser.add_argument('--engine', choices=['thread', 'async'], help="Override [Source] Engine")
+    parser.add_argument('--status-address', help="Override [Service] Status_Address")
+    parser.add_argument('--status-port', type=int, help="Override [Service] Status_Port, 0 = no endpoint")
+    args = parser.parse_args(argv)
+
+    from Middleware_Helper import read_settings
+    settings = read_settings(args.config)
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    status_address = args.status_address or config.get('Service', 'Status_Address', fallback='127.0.0.1')
+    status_port = args.status_port if args.status_port is not None else int(config.get('Service', 'Status_Port', fallback=8765))
+
+    service = MiddlewareService(settings, args.engine or settings['Engine'])
+    if status_port:
+        service.start_status_server(status_address, status_port)
+
+    signal.signal(signal.SIGINT, service.stop)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, service.stop)
+
+    print(f"SPI Middleware started headless ({service.engine_name} engine) in {(time.monotonic() - t_start) * 1000:.0f} ms")
+    service.run()
+    return 0
+
+if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()  # XML parse processes of a packaged exe
+    main()
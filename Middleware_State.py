@@ -0,0 +1,61 @@
+# Per machine event id state, kept across restarts and reconnects.
+# One tiny file per machine (<State_Dir>/<machine>.evt) mapped in memory with mmap :
+#   bytes 0-3 : next event id to hand out (1..9999)
+#   bytes 4-7 : last event id acknowledged by the HSC (0 = none yet)
+# An update is one 8 byte write into the mapping, no file rewrite and no fsync per message.
+# The OS writes the page back by itself, so a crash of the middleware loses nothing;
+# flush() (called on close) is only needed against a power cut.
+import mmap
+import os
+import re
+import struct
+
+SLOT = struct.Struct('<II')  # next event id, last acknowledged event id
+MAX_EVENT_ID = 9999          # Event ids loop back to 1 after 9999
+
+class EventIdState:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        if not os.path.exists(path) or os.path.getsize(path) < SLOT.size:
+            with open(path, 'wb') as f:
+                f.write(SLOT.pack(1, 0))
+
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), SLOT.size)
+        next_event_id, last_acked = SLOT.unpack_from(self.map, 0)
+        self.next_event_id = next_event_id if 1 <= next_event_id <= MAX_EVENT_ID else 1
+        self.last_acked = last_acked
+
+    def _store(self):
+        SLOT.pack_into(self.map, 0, self.next_event_id, self.last_acked)
+
+    def take(self):
+        # Hand out the next event id, the counter is stored before the message is sent
+        event_id = self.next_event_id
+        self.next_event_id = (event_id % MAX_EVENT_ID) + 1
+        self._store()
+        return event_id
+
+    def acked(self, event_id):
+        # XML event ids come from the file as text, anything that is not a number is ignored
+        try:
+            self.last_acked = int(event_id)
+        except (TypeError, ValueError):
+            return
+        self._store()
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        if self.map.closed:
+            return
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+# State file of one machine from read_settings()
+def open_event_state(settings, machine_name):
+    file_name = re.sub(r'[^A-Za-z0-9_-]+', '_', machine_name.strip()) + '.evt'
+    return EventIdState(os.path.join(settings['State_Dir'], file_name))
@@ -0,0 +1,137 @@
+# Per machine latency histograms and counters, fed with the stage times of every uploaded
+# file (the trace carried in the message context, see Middleware_Events.new_trace) :
+#   wait    : file written (mtime) -> detected by the worker    (watcher / polling delay)
+#   parse   : detected -> parsed                                 (index / scan + parsing)
+#   queue   : parsed -> sent                                     (waiting for the send window)
+#   ack     : sent -> ACK received                               (HSC round trip)
+#   archive : ACK -> file moved / deleted / bundled              (Archiver)
+#   total   : detected -> archived
+# "parse" is recorded when the file is parsed, the others once it is archived (a file parsed
+# into the outbox while the link was down is resent without being parsed again : no "queue").
+# Histograms are HDR style : log-linear buckets with ~3 % precision from 1 µs to hours,
+# fixed memory (a few hundred ints) whatever the number of samples.
+# Shown by Help > Statistics in the GUI and in GET /status of the headless service.
+import threading
+import time
+from collections import deque
+
+SUB_BUCKETS = 32  # Buckets per power of two (upper half), i.e. ~3 % relative precision
+RATE_WINDOW = 60  # Seconds of the throughput window
+
+STAGES = (('wait', 'written', 'detected'), ('queue', 'parsed', 'sent'), ('ack', 'sent', 'acked'),
+          ('archive', 'acked', 'archived'), ('total', 'detected', 'archived'))  # Recorded by archived()
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def _index(micros):
+        if micros < SUB_BUCKETS:
+            return micros
+        shift = micros.bit_length() - SUB_BUCKETS.bit_length() + 1  # micros >> shift in [16, 31]
+        return SUB_BUCKETS + (shift - 1) * (SUB_BUCKETS // 2) + (micros >> shift) - SUB_BUCKETS // 2
+
+    @staticmethod
+    def _value(index):
+        # Highest value (µs) of a bucket
+        if index < SUB_BUCKETS:
+            return index
+        shift, sub = divmod(index - SUB_BUCKETS, SUB_BUCKETS // 2)
+        shift += 1
+        return ((sub + SUB_BUCKETS // 2 + 1) << shift) - 1
+
+    def record(self, seconds):
+        seconds = max(0.0, seconds)
+        index = self._index(int(seconds * 1e6))
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        # Seconds below which percent % of the samples are (None without samples)
+        if not self.count:
+            return None
+        rank = max(1, round(self.count * percent / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._value(index) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        # Milliseconds, for the status endpoint / the statistics dialog
+        if not self.count:
+            return {'count': 0}
+        ms = lambda seconds: round(seconds * 1000, 2)
+        return {'count': self.count, 'mean': ms(self.total / self.count), 'p50': ms(self.percentile(50)),
+                'p90': ms(self.percentile(90)), 'p99': ms(self.percentile(99)), 'max': ms(self.max)}
+
+class MachineStats:
+    def __init__(self):
+        self.lock = threading.Lock()  # Fed by the worker and by the archiver thread
+        self.histograms = {name: LatencyHistogram() for name in ('wait', 'parse', 'queue', 'ack', 'archive', 'total')}
+        self.counters = {'parsed': 0, 'acked': 0, 'failed': 0, 'archived': 0, 'skipped': 0}
+        self.recent = deque()  # Monotonic times of the ACKs of the last RATE_WINDOW seconds
+        self.started = time.monotonic()
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def parsed(self, trace):
+        with self.lock:
+            self.counters['parsed'] += 1
+            self.histograms['parse'].record(trace['parsed'] - trace['detected'])
+
+    def acked(self):
+        now = time.monotonic()
+        with self.lock:
+            self.counters['acked'] += 1
+            self.recent.append(now)
+            while self.recent and self.recent[0] < now - RATE_WINDOW:
+                self.recent.popleft()
+
+    def archived(self, trace):
+        # All stage times are known once the file is archived. "written" is the file mtime
+        # (wall clock), the wait is measured against the wall clock time of the detection.
+        offset = time.time() - time.monotonic()
+        with self.lock:
+            self.counters['archived'] += 1
+            for name, start, end in STAGES:
+                begin, finish = trace.get(start), trace.get(end)
+                if begin is None or finish is None:
+                    continue  # e.g. resent from the outbox : not parsed in this cycle
+                if start == 'written':
+                    finish += offset
+                self.histograms[name].record(finish - begin)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            while self.recent and self.recent[0] < now - RATE_WINDOW:
+                self.recent.popleft()
+            window = min(RATE_WINDOW, max(1e-3, now - self.started))
+            return {'counters': dict(self.counters),
+                    'rate_per_min': round(len(self.recent) * 60 / window, 1),
+                    'latency_ms': {name: histogram.summary() for name, histogram in self.histograms.items()}}
+
+# Plain text of engine.snapshot() for the GUI dialog
+def format_statistics(statistics):
+    lines = []
+    for machine in statistics:
+        stats = machine['stats']
+        counters = stats['counters']
+        lines.append(f"{machine['name']} : {counters['acked']} acked, {counters['failed']} failed, "
+                     f"{counters['skipped']} skipped, {stats['rate_per_min']} / min")
+        for name, summary in stats['latency_ms'].items():
+            if summary['count']:
+                lines.append(f"    {name:<8} p50 {summary['p50']:>9} ms   p99 {summary['p99']:>9} ms   max {summary['max']:>9} ms")
+    return "\n".join(lines)
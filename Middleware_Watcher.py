@@ -0,0 +1,217 @@
+# Directory watchers that wake a worker as soon as a result file is written.
+# Linux uses inotify (IN_CLOSE_WRITE / IN_MOVED_TO), everything else falls back
+# to the plain polling loop the middleware always had.
+import os
+import sys
+import select
+import struct
+import threading
+
+########### 1. inotify constants ##########
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+_libc = None
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        import ctypes
+        import ctypes.util
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+def inotify_available():
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        return hasattr(_load_libc(), "inotify_init1")
+    except OSError:
+        return False
+
+########### 2. Watcher backends ##########
+
+class PollingWatcher:
+    # Fallback backend : wait() simply sleeps the polling interval (same as before),
+    # but can be woken up early by wake() so Stop does not have to wait a full cycle.
+    backend = "poll"
+
+    def __init__(self, paths, recursive=False, extensions=None):
+        self.paths = list(paths)
+        self._wake_event = threading.Event()
+
+    def wait(self, timeout):
+        # Returns True when woken up early, False when the timeout expired
+        woken = self._wake_event.wait(timeout)
+        self._wake_event.clear()
+        return woken
+
+    def wake(self):
+        self._wake_event.set()
+
+    def take_created(self):
+        return set()  # No file events without inotify, the readiness check relies on size/mtime
+
+    def take_closed(self):
+        return set()
+
+    def close(self):
+        self.wake()
+
+class InotifyWatcher:
+    # Event-driven backend : wait() blocks on the inotify fd and returns as soon as
+    # a matching file is closed after writing (or moved) in one of the watched dirs.
+    backend = "inotify"
+
+    def __init__(self, paths, recursive=False, extensions=None):
+        import ctypes
+        self._ctypes = ctypes
+        self.libc = _load_libc()
+        self.recursive = recursive
+        self.extensions = tuple(ext.lower() for ext in extensions) if extensions else None
+        self.watch_dirs = {}  # wd -> directory path
+        self.created_files = set()  # Result files created since the last take_created() (being written)
+        self.closed_files = set()   # Result files closed after writing since the last take_closed()
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._wake_r, self._wake_w = os.pipe()  # Self-pipe so wake() can interrupt select()
+        self._wake_lock = threading.Lock()  # wake() may come from another thread while close() runs
+
+        try:
+            for path in paths:
+                if recursive:
+                    self._add_tree(path)
+                else:
+                    self._add_watch(path)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = self._ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch failed: {os.strerror(err)}", path)
+        self.watch_dirs[wd] = path
+
+    def _add_tree(self, path):
+        self._add_watch(path)
+        for root, dirs, _ in os.walk(path):
+            for d in dirs:
+                try:
+                    self._add_watch(os.path.join(root, d))
+                except OSError:
+                    pass  # Directory vanished while walking, the next rescan will catch it
+
+    def _matches(self, name):
+        return self.extensions is None or name.lower().endswith(self.extensions)
+
+    def read_events(self):
+        # Drain the inotify queue, return True if any event concerns a result file
+        found = False
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not buf:
+                break
+
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(buf):
+                wd, mask, _, name_len = EVENT_HEADER.unpack_from(buf, offset)
+                offset += EVENT_HEADER.size
+                name = buf[offset:offset + name_len].rstrip(b"\0").decode(errors="replace")
+                offset += name_len
+
+                if mask & IN_Q_OVERFLOW:
+                    found = True  # Events were lost, force a full rescan
+                elif mask & IN_IGNORED:
+                    self.watch_dirs.pop(wd, None)
+                elif mask & IN_ISDIR:
+                    if self.recursive and mask & (IN_CREATE | IN_MOVED_TO) and wd in self.watch_dirs:
+                        try:
+                            self._add_tree(os.path.join(self.watch_dirs[wd], name))
+                        except OSError:
+                            pass
+                        found = True  # Files may already exist in the new folder
+                elif mask & IN_CREATE and self._matches(name):
+                    if wd in self.watch_dirs:
+                        self.created_files.add(os.path.join(self.watch_dirs[wd], name))
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and self._matches(name):
+                    if wd in self.watch_dirs:
+                        self.closed_files.add(os.path.join(self.watch_dirs[wd], name))
+                    found = True
+        return found
+
+    def wait(self, timeout):
+        # Returns True on a file event (or wake()), False when the timeout expired
+        readable, _, _ = select.select([self.fd, self._wake_r], [], [], timeout)
+        woken = False
+        if self._wake_r in readable:
+            os.read(self._wake_r, 4096)
+            woken = True
+        if self.fd in readable and self.read_events():
+            woken = True
+        return woken
+
+    def take_created(self):
+        # Paths of the result files created since the last call, their IN_CLOSE_WRITE is still to come
+        created, self.created_files = self.created_files, set()
+        return created
+
+    def take_closed(self):
+        # Paths of the result files completely written (closed or moved in) since the last call
+        closed, self.closed_files = self.closed_files, set()
+        return closed
+
+    def wake(self):
+        with self._wake_lock:
+            if self._wake_w is None:
+                return  # Closed : the fd number may already belong to another file
+            try:
+                os.write(self._wake_w, b"x")
+            except OSError:
+                pass  # Pipe full, a wake-up is pending anyway
+
+    def close(self):
+        with self._wake_lock:
+            fds = (self.fd, self._wake_r, self._wake_w)
+            self._wake_w = None
+        for fd in fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.fd = -1
+
+########### 3. Factory ##########
+
+def create_watcher(paths, mode="auto", recursive=False, extensions=None):
+    # mode : "auto" = inotify when available, else polling; "inotify" = same but log the fallback; "poll" = always poll
+    mode = (mode or "auto").strip().lower()
+    if mode != "poll" and inotify_available():
+        try:
+            return InotifyWatcher(paths, recursive, extensions)
+        except OSError as e:
+            print(f"inotify watcher unavailable ({e}), falling back to polling")
+    elif mode == "inotify":
+        print("inotify is not supported on this platform, falling back to polling")
+    return PollingWatcher(paths, recursive, extensions)
@@ -0,0 +1,191 @@
+# Palmi XML extraction. [PALMI_XML_Mapping] is compiled ONCE (read_settings) into an
+# XmlPlan instead of running re.match + root.find per key on every file :
+#   - "key = .//Tag[@attribute]"  (or ".//Tag" for the text) : all such fields are
+#     collected in a single walk of the tree, first element of each tag wins
+#     (same element root.find(".//Tag") returns),
+#   - any other ElementTree path ("./Panel/Board[@x]", ...) is kept and looked up with root.find.
+# A mapping that is not a valid path, or a missing key, raises ValueError at start-up
+# instead of silently giving "N/A" on every file.
+#
+# [Source] XML_Parser = stream : when every mapping is a ".//Tag" one, the file is read
+# with iterparse and reading stops as soon as each tag has been seen (Panel / Board are
+# near the top of a Palmi report, the thousands of component/pad elements below are
+# never read). Elements are cleared as they end, so memory stays flat on big reports.
+# Note the early exit also means a report that is cut off AFTER its header still gives
+# its fields, where the tree parser rejects it.
+import os
+import re
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+XML_FIELDS = ('start_insptime', 'event_id', 'serial', 'serial_nr_state')  # configparser keys are lower case
+
+MAPPING_PATTERN = re.compile(r"(.+?)\[@([\w:.-]+)\]")  # "path[@attribute]"
+DESCENDANT_PATTERN = re.compile(r"\.//([\w:.-]+)")     # ".//Tag", no further steps
+
+class XmlPlan:
+    def __init__(self, xml_mappings, streaming=False):
+        missing = [key for key in XML_FIELDS if key not in xml_mappings]
+        if missing:
+            raise ValueError(f"[PALMI_XML_Mapping] missing {', '.join(missing)}")
+
+        self.fields = []   # (key, element path, attribute or None for the text), in XML_FIELDS order
+        self.by_tag = {}   # tag -> [(position, attribute)] for ".//Tag" paths, one tree walk
+        self.by_path = []  # (position, element path, attribute) for the other paths, root.find
+        for position, key in enumerate(XML_FIELDS):
+            xpath = xml_mappings[key].strip()
+            match = MAPPING_PATTERN.fullmatch(xpath)
+            if match:
+                element_path, attribute_name = match.groups()  # Extract element and attribute
+            elif '[' in xpath:
+                raise ValueError(f"[PALMI_XML_Mapping] {key} = {xpath} : only [@attribute] is supported")
+            else:
+                element_path, attribute_name = xpath, None  # If no attribute, extract text
+
+            try:
+                ET.Element('root').find(element_path)  # Compiles (and caches) the path, raises if invalid
+            except (SyntaxError, KeyError, ValueError) as e:
+                raise ValueError(f"[PALMI_XML_Mapping] {key} = {xpath} : {e}")
+
+            self.fields.append((key, element_path, attribute_name))
+            descendant = DESCENDANT_PATTERN.fullmatch(element_path)
+            if descendant:
+                self.by_tag.setdefault(descendant.group(1), []).append((position, attribute_name))
+            else:
+                self.by_path.append((position, element_path, attribute_name))
+
+        self.streaming = streaming and not self.by_path  # Other paths need the whole tree
+        self.text_tags = {tag for tag, fields in self.by_tag.items() if any(attribute is None for _, attribute in fields)}
+
+    @staticmethod
+    def _value(element, attribute_name):
+        if attribute_name:
+            return element.get(attribute_name, "N/A")  # Get attribute value
+        return element.text.strip() if element.text else "N/A"  # Get text
+
+    def extract_root(self, root):
+        # [start_Insptime, event_id, serial, serial_nr_state] from a parsed tree, "N/A" when not found
+        values = ["N/A"] * len(self.fields)
+        remaining = len(self.by_tag)
+        if remaining:
+            elements = root.iter()
+            next(elements)  # ".//Tag" searches below the root, not the root itself
+            found = set()
+            for element in elements:
+                fields = self.by_tag.get(element.tag)
+                if fields is None or element.tag in found:
+                    continue
+                found.add(element.tag)
+                for position, attribute_name in fields:
+                    values[position] = self._value(element, attribute_name)
+                remaining -= 1
+                if not remaining:
+                    break
+
+        for position, element_path, attribute_name in self.by_path:
+            element = root.find(element_path)
+            if element is not None:
+                values[position] = self._value(element, attribute_name)
+        return values
+
+    def extract_stream(self, file_path):
+        # Same result as extract_root(), reading only until every mapped tag has been seen
+        values = ["N/A"] * len(self.fields)
+        remaining = set(self.by_tag)
+        depth = 0
+        with open(file_path, 'rb') as f:  # Closed on the early exit, the file can be moved right away
+            for event, element in ET.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    # Attributes are complete on 'start', the text only on 'end'
+                    if depth > 1 and element.tag in remaining and element.tag not in self.text_tags:
+                        for position, attribute_name in self.by_tag[element.tag]:
+                            values[position] = self._value(element, attribute_name)
+                        remaining.discard(element.tag)
+                else:
+                    depth -= 1
+                    if depth > 0 and element.tag in remaining and element.tag in self.text_tags:
+                        for position, attribute_name in self.by_tag[element.tag]:
+                            values[position] = self._value(element, attribute_name)
+                        remaining.discard(element.tag)
+                    element.clear()  # Nothing below is needed anymore
+                if not remaining:
+                    break
+        return values
+
+    def extract(self, file_path):
+        try:
+            if self.streaming:
+                return self.extract_stream(file_path)
+            return self.extract_root(ET.parse(file_path).getroot())
+        except ET.ParseError:
+            print(f"Error parsing {file_path}")
+        return ["N/A"] * len(self.fields)
+
+# Plan from the [PALMI_XML_Mapping] items, raises ValueError on a bad mapping
+def compile_xml_mappings(xml_mappings, parser='tree'):
+    if parser not in ('tree', 'stream'):
+        raise ValueError(f"XML_Parser = {parser} : use tree or stream")
+    return XmlPlan(xml_mappings, streaming=(parser == 'stream'))
+
+########### Parse stage ##########
+
+# XML files oldest first (the order they are sent in), files that disappeared are left out.
+# mtimes (path -> mtime, e.g. TreeScanner.mtimes) saves the stat per file
+def sort_by_mtime(paths, mtimes=None):
+    dated = []
+    for path in paths:
+        try:
+            dated.append((mtimes[path] if mtimes is not None else os.stat(path).st_mtime_ns, path))
+        except (OSError, KeyError):
+            continue
+    dated.sort()
+    return [path for _, path in dated]
+
+# Compact records (path, mtime, event_id, serial, result) for a list of XML files.
+# Files that disappeared or cannot be read right now (locked by the machine) are left out :
+# not marked as broken, they are tried again with the next scan if they are still there.
+def parse_records(plan, paths):
+    for path in paths:
+        try:
+            mtime = os.path.getmtime(path)
+            start_Insptime, event_id, serial, result = plan.extract(path)
+        except FileNotFoundError:
+            continue  # Moved or deleted since the scan
+        except OSError as e:
+            print(f"Cannot read {path} ({e}), retrying next cycle")
+            continue
+        yield path, mtime, event_id, serial, result
+
+_plan = None  # XmlPlan of a pool process, sent once by _init_parser
+
+def _init_parser(plan):
+    global _plan
+    _plan = plan
+
+def _parse_batch(paths):
+    return list(parse_records(_plan, paths))
+
+# [Source] Parse_Workers > 0 : XML parsing runs in a process pool shared by all XML lines,
+# so it no longer holds the GIL (nor the thread that owns the socket) while parsing
+class ParsePool:
+    def __init__(self, plan, workers, batch_size=16):
+        self.batch_size = batch_size
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_parser, initargs=(plan,))
+
+    def parse(self, paths):
+        # Records in the order of paths (sort_by_mtime : oldest first), yielded batch by batch
+        # as soon as each batch is parsed, so the first files are sent while the rest is parsed
+        paths = list(paths)
+        batches = [paths[i:i + self.batch_size] for i in range(0, len(paths), self.batch_size)]
+        for batch in self.executor.map(_parse_batch, batches):
+            yield from batch
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+# ParsePool from read_settings(), None when [Source] Parse_Workers = 0
+def open_parse_pool(settings):
+    if settings['Parse_Workers'] <= 0 or 'XML' not in settings['File_Types']:
+        return None
+    return ParsePool(settings['XML_Plan'], settings['Parse_Workers'])